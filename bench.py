@@ -0,0 +1,268 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import platform
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+from bot.backends import FileBackend, StorageBackend
+from bot.chain import ChainModel
+from bot.sqlite_backend import SqliteBackend
+from bot.storage import ChatStorage
+from bot.textgen import generate, generate_batch, is_allowed_text, size_to_name
+
+SIZES = (0, 1, 2, 3)
+TRIES = (1, 10, 100, 300)
+
+
+def synthetic_corpus(lines: int, seed: int, vocab_size: int = 20000) -> list[str]:
+    rng = random.Random(seed)
+    vocab = [f"w{i}" for i in range(vocab_size)]
+    weights = [1 / (rank + 1) for rank in range(vocab_size)]
+    corpus = []
+    for _ in range(lines):
+        length = min(40, max(1, int(rng.lognormvariate(1.6, 0.7))))
+        corpus.append(" ".join(rng.choices(vocab, weights, k=length)))
+    return corpus
+
+
+def percentiles(values: list[float]) -> dict[str, float]:
+    ordered = sorted(values)
+
+    def pick(q: float) -> float:
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    return {
+        "mean_ms": statistics.fmean(ordered) * 1000,
+        "p50_ms": pick(0.50) * 1000,
+        "p90_ms": pick(0.90) * 1000,
+        "p99_ms": pick(0.99) * 1000,
+        "max_ms": ordered[-1] * 1000,
+    }
+
+
+def peak_rss_mb() -> float:
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / (1024 * 1024)
+
+
+def timed(func: Callable[[], Any]) -> tuple[Any, float]:
+    started = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - started
+
+
+def bench_generation(model: ChainModel, runs: int, tries_count: int) -> dict[str, Any]:
+    results: dict[str, Any] = {}
+    for size in SIZES:
+        latencies = []
+        hits = 0
+        for _ in range(runs):
+            out, elapsed = timed(lambda: generate(model, tries_count=tries_count, size=size))
+            latencies.append(elapsed)
+            hits += out is not None
+        results[size_to_name(size)] = {**percentiles(latencies), "success_rate": hits / runs}
+    return results
+
+
+def bench_success(model: ChainModel, runs: int) -> dict[str, dict[str, float]]:
+    results: dict[str, dict[str, float]] = {}
+    for size in SIZES:
+        results[size_to_name(size)] = {
+            str(tries): sum(
+                generate(model, tries_count=tries, size=size) is not None for _ in range(runs)
+            ) / runs
+            for tries in TRIES
+        }
+    return results
+
+
+def bench_batch(model: ChainModel, runs: int, count: int = 32) -> dict[str, dict[str, float]]:
+    # the first bounded batch compiles the chain
+    results: dict[str, dict[str, float]] = {}
+    generate_batch(model, count, size=1)
+    for size in SIZES:
+        scalar, scalar_elapsed = timed(
+            lambda: [generate(model, tries_count=300, size=size) for _ in range(count * runs)]
+        )
+        batches, batch_elapsed = timed(
+            lambda: [
+                generate_batch(model, count, tries_count=count * 10, size=size)
+                for _ in range(runs)
+            ]
+        )
+        produced = sum(map(len, batches))
+        results[size_to_name(size)] = {
+            "scalar_per_sec": sum(out is not None for out in scalar) / scalar_elapsed,
+            "batch_per_sec": produced / batch_elapsed,
+            "batch_yield": produced / (count * runs),
+        }
+    return results
+
+
+def bench_appends(
+    backend: StorageBackend,
+    corpus: list[str],
+    batched: bool,
+) -> dict[str, float]:
+    storage = ChatStorage(backend, journal_flush_interval=0.05)
+
+    async def run() -> float:
+        if batched:
+            await storage.start()
+        started = time.perf_counter()
+        for line in corpus:
+            storage.append_sample(1, line)
+        await storage.journal.close()
+        return time.perf_counter() - started
+
+    elapsed = asyncio.run(run())
+    # separate cold storages, so count_samples is not answered from the samples cache
+    loader, counter = ChatStorage(backend), ChatStorage(backend)
+    _, load_elapsed = timed(lambda: loader.load_samples(1))
+    _, count_elapsed = timed(lambda: counter.count_samples(1))
+    backend.close()
+    return {
+        "appends_per_sec": len(corpus) / elapsed,
+        "load_samples_ms": load_elapsed * 1000,
+        "count_samples_ms": count_elapsed * 1000,
+    }
+
+
+def bench_roundtrip(corpus: list[str], runs: int, seed: int) -> dict[str, float]:
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        storage = ChatStorage(FileBackend(Path(tmp) / "dialogs", Path(tmp) / "settings"))
+        storage.backend.append_samples(1, corpus)
+        storage.chain(1)
+
+        latencies = []
+        for _ in range(runs):
+            text = rng.choice(corpus)
+            started = time.perf_counter()
+            storage.activate(1)
+            settings = storage.load_settings(1)
+            if is_allowed_text(text, settings):
+                storage.append_sample(1, text)
+            model = storage.chain(1)
+            if model.sample_count >= settings.min_samples:
+                generate(model, tries_count=200, size=settings.default_gen_size)
+            latencies.append(time.perf_counter() - started)
+        storage.backend.close()
+    return percentiles(latencies)
+
+
+def run_suite(
+    lines: int,
+    seed: int,
+    runs: int,
+    backends: list[str],
+    order: int = 1,
+) -> dict[str, Any]:
+    corpus = synthetic_corpus(lines, seed)
+    random.seed(seed)
+
+    model, build_elapsed = timed(lambda: ChainModel.from_samples(corpus, order=order))
+    result: dict[str, Any] = {
+        "lines": lines,
+        "order": order,
+        "chain_build_ms": build_elapsed * 1000,
+        "vocab_size": len(model.vocab),
+        "generation": bench_generation(model, runs, tries_count=300),
+        "success_by_tries": bench_success(model, max(1, runs // 4)),
+        "batch": bench_batch(model, max(1, runs // 20)),
+        "roundtrip": bench_roundtrip(corpus, runs, seed),
+        "storage": {},
+    }
+
+    for name in backends:
+        for batched in (False, True):
+            with tempfile.TemporaryDirectory() as tmp:
+                backend: StorageBackend
+                if name == "sqlite":
+                    backend = SqliteBackend(Path(tmp) / "bench.sqlite3")
+                else:
+                    backend = FileBackend(Path(tmp) / "dialogs", Path(tmp) / "settings")
+                key = f"{name}_{'batched' if batched else 'write_through'}"
+                result["storage"][key] = bench_appends(backend, corpus, batched)
+
+    result["peak_rss_mb"] = peak_rss_mb()
+    return result
+
+
+def run_isolated(
+    lines: int,
+    seed: int,
+    runs: int,
+    backends: list[str],
+    order: int = 1,
+) -> dict[str, Any]:
+    # ru_maxrss never goes down, so each corpus gets a fresh interpreter and its
+    # peak_rss_mb does not include the ones before it
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+        return pool.submit(run_suite, lines, seed, runs, backends, order).result()
+
+
+def compare(current: dict[str, Any], baseline: dict[str, Any], prefix: str = "") -> None:
+    for key, value in current.items():
+        old = baseline.get(key)
+        name = f"{prefix}{key}"
+        if isinstance(value, dict) and isinstance(old, dict):
+            compare(value, old, f"{name}.")
+        elif isinstance(value, (int, float)) and isinstance(old, (int, float)) and old:
+            print(f"{name}: {old:.3f} -> {value:.3f} ({(value - old) / old * 100:+.1f}%)")
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Offline benchmarks for textgen and storage")
+    parser.add_argument("--lines", default="1000,10000,100000", help="comma-separated corpus sizes")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--runs", type=int, default=200, help="generate() calls per size bucket")
+    parser.add_argument("--order", type=int, default=1, help="chain order (1-3)")
+    parser.add_argument("--backends", default="files,sqlite")
+    parser.add_argument("--output", type=Path, help="write results as JSON")
+    parser.add_argument("--compare", type=Path, help="print deltas against an earlier JSON run")
+    args = parser.parse_args(argv)
+
+    report: dict[str, Any] = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "seed": args.seed,
+            "runs": args.runs,
+            "order": args.order,
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        },
+        "corpora": {},
+    }
+    backends = [name for name in args.backends.split(",") if name]
+    for lines in (int(value) for value in args.lines.split(",")):
+        print(f"benchmarking {lines} lines...", file=sys.stderr)
+        report["corpora"][str(lines)] = run_isolated(
+            lines, args.seed, args.runs, backends, args.order
+        )
+
+    payload = json.dumps(report, indent=2)
+    if args.output:
+        args.output.write_text(payload, encoding="utf8")
+    else:
+        print(payload)
+
+    if args.compare:
+        baseline = json.loads(args.compare.read_text(encoding="utf8"))
+        compare(report["corpora"], baseline.get("corpora", {}))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,33 @@
 from __future__ import annotations
 
+import asyncio
+import contextlib
+from typing import Awaitable, Callable, Optional
+
 from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.client.session.base import BaseSession
 
+from .backends import open_backend
 from .config import AppConfig
+from .executor import GenerationExecutor
 from .handlers import build_router
+from .metrics import (
+    ACTIVE_CHATS,
+    CACHE_HITS,
+    CACHE_MISSES,
+    REGISTRY,
+    log_metrics,
+    start_metrics_server,
+)
+from .middlewares import MetricsMiddleware
+from .outbox import SendScheduler
+from .replypool import ReplyPool
+from .redis_store import open_fsm_storage, open_settings_cache
 from .storage import ChatStorage
+from .webhook import run_webhook
+
+
+Intake = Callable[[Dispatcher, Bot, AppConfig], Awaitable[None]]
 
 
 async def run_bot(config: AppConfig | None = None) -> None:
@@ -13,14 +35,118 @@ async def run_bot(config: AppConfig | None = None) -> None:
     if not app_config.token:
         raise RuntimeError("TELEGRAM_TOKEN is not set")
 
+    if app_config.workers > 1:
+        from .sharding import run_front
+
+        await run_front(app_config, receive_updates)
+    else:
+        await run_dispatcher(app_config, receive_updates)
+
+
+async def receive_updates(dispatcher: Dispatcher, bot: Bot, config: AppConfig) -> None:
+    if config.run_mode == "webhook":
+        await run_webhook(dispatcher, bot, config)
+    else:
+        await bot.delete_webhook(drop_pending_updates=True)
+        await dispatcher.start_polling(bot)
+
+
+async def run_dispatcher(
+    app_config: AppConfig,
+    intake: Intake,
+    session: Optional[BaseSession] = None,
+) -> None:
     storage = ChatStorage(
-        dialogs_dir=app_config.dialogs_dir,
-        settings_dir=app_config.settings_dir,
+        open_backend(app_config),
+        cache_max_chats=app_config.cache_max_chats,
+        cache_max_bytes=app_config.cache_max_bytes,
+        journal_max_batch=app_config.journal_max_batch,
+        journal_flush_interval=app_config.journal_flush_interval,
+        novelty_index=app_config.novelty_index,
+        snapshot_dir=app_config.snapshot_dir,
+        snapshot_every=app_config.snapshot_every,
+        compact_every=app_config.compact_every,
+        shared_settings=open_settings_cache(app_config),
+        chat_idle_ttl=app_config.chat_idle_ttl,
+        sweep_interval=app_config.chat_sweep_interval,
+        io_workers=app_config.storage_io_workers,
+    )
+
+    generator = GenerationExecutor(
+        pool_type=app_config.gen_pool_type,
+        pool_size=app_config.gen_pool_size,
+        max_inflight_per_chat=app_config.gen_max_inflight_per_chat,
+        max_inflight=app_config.gen_max_inflight,
+        payload_max_stale=app_config.gen_payload_max_stale,
+        hold=storage.hold_chain,
     )
 
-    bot = Bot(token=app_config.token)
-    dispatcher = Dispatcher(storage=MemoryStorage())
-    dispatcher.include_router(build_router(storage))
+    outbox = SendScheduler(
+        global_rate=app_config.send_global_rate,
+        global_burst=app_config.send_global_burst,
+        chat_rate=app_config.send_chat_rate,
+        chat_burst=app_config.send_chat_burst,
+        max_queue=app_config.send_queue_size,
+        auto_reply_ttl=app_config.auto_reply_ttl,
+        max_retries=app_config.send_max_retries,
+    )
+
+    replies = ReplyPool(
+        storage,
+        generator,
+        pool_size=app_config.reply_pool_size,
+        max_chats=app_config.reply_pool_max_chats,
+        refill_rate=app_config.reply_pool_refill_rate,
+        max_age=app_config.reply_pool_max_age,
+        max_stale=app_config.reply_pool_max_stale,
+        idle_after=app_config.reply_pool_idle_after,
+    )
+
+    router = build_router(storage, generator, outbox, replies)
+    metrics_enabled = app_config.metrics_port > 0 or app_config.metrics_log_interval > 0
+    if metrics_enabled:
+        for observer in (router.message, router.callback_query, router.my_chat_member):
+            observer.middleware(MetricsMiddleware())
+
+        # LRUCache keeps running totals; the counters advance by what is new
+        reported: dict[str, tuple[int, int]] = {}
+
+        def collect_cache_stats() -> None:
+            for cache, stats in storage.cache_stats().items():
+                hits, misses = reported.get(cache, (0, 0))
+                CACHE_HITS.inc(stats["hits"] - hits, cache=cache)
+                CACHE_MISSES.inc(stats["misses"] - misses, cache=cache)
+                reported[cache] = (stats["hits"], stats["misses"])
+            ACTIVE_CHATS.set(len(storage.registry))
+
+        REGISTRY.on_collect(collect_cache_stats)
+
+    bot = Bot(token=app_config.token, session=session)
+    fsm_storage = open_fsm_storage(app_config)
+    dispatcher = Dispatcher(storage=fsm_storage)
+    dispatcher.include_router(router)
+
+    await storage.start()
+    outbox.start()
+    replies.start()
+    metrics_runner = None
+    if app_config.metrics_port > 0:
+        metrics_runner = await start_metrics_server(app_config.metrics_host, app_config.metrics_port)
+    metrics_task = None
+    if app_config.metrics_log_interval > 0:
+        metrics_task = asyncio.create_task(log_metrics(app_config.metrics_log_interval))
 
-    await bot.delete_webhook(drop_pending_updates=True)
-    await dispatcher.start_polling(bot)
+    try:
+        await intake(dispatcher, bot, app_config)
+    finally:
+        if metrics_task is not None:
+            metrics_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await metrics_task
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await outbox.close()
+        await replies.close()
+        generator.shutdown()
+        await storage.close()
+        await fsm_storage.close()
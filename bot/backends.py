@@ -0,0 +1,297 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Iterable, Iterator, Optional, Protocol, TextIO
+
+from .cache import LRUCache
+from .config import AppConfig
+from .retention import SampleRecord
+from .settings_store import SettingsStore
+
+DURABILITY_MODES = ("none", "flush", "fsync")
+
+_META = "\x01"
+_TIME_MARK = _META + "t"
+_WEIGHT_MARK = _META + "w"
+
+
+def parse_records(lines: Iterable[str]) -> Iterator[SampleRecord]:
+    timestamp = 0
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        if not line.startswith(_META):
+            yield line, 1, timestamp
+            continue
+        kind, body = line[1:2], line[2:]
+        try:
+            if kind == "t":
+                timestamp = int(body)
+            elif kind == "w":
+                weight, _, text = body.partition(" ")
+                if text:
+                    yield text, int(weight), timestamp
+        except ValueError:
+            continue
+
+
+def encode_records(records: Iterable[SampleRecord]) -> str:
+    parts = []
+    current = None
+    for text, weight, timestamp in records:
+        if timestamp != current:
+            parts.append(f"{_TIME_MARK}{timestamp}\n")
+            current = timestamp
+        parts.append(f"{_WEIGHT_MARK}{weight} {text}\n" if weight != 1 else f"{text}\n")
+    return "".join(parts)
+
+
+def expand_records(records: Iterable[SampleRecord]) -> Iterator[str]:
+    for text, weight, _ in records:
+        for _ in range(weight):
+            yield text
+
+
+class StorageBackend(Protocol):
+    def chat_ids(self) -> list[int]: ...
+
+    def ensure_chat(self, chat_id: int) -> None: ...
+
+    def load_samples(self, chat_id: int) -> list[str]: ...
+
+    def iter_samples(self, chat_id: int) -> Iterator[str]: ...
+
+    def iter_samples_from(self, chat_id: int, offset: int) -> Iterator[str]: ...
+
+    def iter_weighted(self, chat_id: int) -> Iterator[tuple[str, int]]: ...
+
+    def iter_records(self, chat_id: int, end: Optional[int] = None) -> Iterator[SampleRecord]: ...
+
+    def sample_offset(self, chat_id: int) -> int: ...
+
+    def append_samples(self, chat_id: int, lines: list[str]) -> None: ...
+
+    def clear_samples(self, chat_id: int) -> None: ...
+
+    def count_samples(self, chat_id: int) -> int: ...
+
+    def data_size(self, chat_id: int) -> int: ...
+
+    def sync(self, chat_id: int) -> None: ...
+
+    def stage_rewrite(self, chat_id: int, records: list[SampleRecord]) -> Any: ...
+
+    def commit_rewrite(self, chat_id: int, staged: Any, end: int) -> None: ...
+
+    def discard_rewrite(self, staged: Any) -> None: ...
+
+    def load_settings(self, chat_id: int) -> Optional[dict[str, Any]]: ...
+
+    def save_settings(self, chat_id: int, data: dict[str, Any]) -> None: ...
+
+    def release(self, chat_id: int) -> None: ...
+
+    def close(self) -> None: ...
+
+
+class FileBackend:
+    def __init__(
+        self,
+        dialogs_dir: Path,
+        settings_dir: Path,
+        durability: str = "flush",
+        max_open_files: int = 128,
+        mark_interval: int = 3600,
+        settings_flush_delay: float = 0.5,
+    ):
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"durability must be one of {', '.join(DURABILITY_MODES)}")
+        self.dialogs_dir = dialogs_dir
+        self.settings_dir = settings_dir
+        self.durability = durability
+        self.mark_interval = mark_interval
+        self._marks: dict[int, int] = {}
+        self.settings = SettingsStore(
+            settings_dir / "chats.json", legacy_dir=settings_dir, flush_delay=settings_flush_delay
+        )
+        # guards the open-file cache and appends across storage I/O threads
+        self._lock = threading.RLock()
+        self._files: LRUCache[int, TextIO] = LRUCache(
+            max_open_files, on_evict=lambda _, file: file.close()
+        )
+        self.ensure_dirs()
+
+    def ensure_dirs(self) -> None:
+        self.dialogs_dir.mkdir(parents=True, exist_ok=True)
+        self.settings_dir.mkdir(parents=True, exist_ok=True)
+
+    def dialog_path(self, chat_id: int) -> Path:
+        return self.dialogs_dir / f"{chat_id}.txt"
+
+    def chat_ids(self) -> list[int]:
+        chat_ids = []
+        for path in self.dialogs_dir.glob("*.txt"):
+            try:
+                chat_ids.append(int(path.stem))
+            except ValueError:
+                continue
+        return sorted(chat_ids)
+
+    def ensure_chat(self, chat_id: int) -> None:
+        self.ensure_dirs()
+        path = self.dialog_path(chat_id)
+        if not path.exists():
+            path.write_text("", encoding="utf8")
+
+    def load_samples(self, chat_id: int) -> list[str]:
+        return list(self.iter_samples(chat_id))
+
+    def iter_samples(self, chat_id: int) -> Iterator[str]:
+        return expand_records(self.iter_records(chat_id))
+
+    def iter_samples_from(self, chat_id: int, offset: int) -> Iterator[str]:
+        return expand_records(parse_records(self._read_lines(chat_id, offset)))
+
+    def iter_weighted(self, chat_id: int) -> Iterator[tuple[str, int]]:
+        for text, weight, _ in self.iter_records(chat_id):
+            yield text, weight
+
+    def iter_records(self, chat_id: int, end: Optional[int] = None) -> Iterator[SampleRecord]:
+        return parse_records(self._read_lines(chat_id, 0, end))
+
+    def _read_lines(self, chat_id: int, start: int, end: Optional[int] = None) -> Iterator[str]:
+        self.sync(chat_id)
+        try:
+            file = self.dialog_path(chat_id).open("rb")
+        except OSError:
+            return
+        with file:
+            file.seek(start)
+            position = start
+            for raw in file:
+                position += len(raw)
+                if end is not None and position > end:
+                    return
+                yield raw.decode("utf8", errors="replace")
+
+    def sample_offset(self, chat_id: int) -> int:
+        return self.data_size(chat_id)
+
+    def append_samples(self, chat_id: int, lines: list[str]) -> None:
+        with self._lock:
+            file = self._files.peek(chat_id)
+            if file is None:
+                self.ensure_dirs()
+                file = self.dialog_path(chat_id).open("a", encoding="utf8")
+                self._files.put(chat_id, file)
+            payload = "\n".join(lines) + "\n"
+            mark = int(time.time()) // self.mark_interval * self.mark_interval
+            if self._marks.get(chat_id) != mark:
+                payload = f"{_TIME_MARK}{mark}\n{payload}"
+                self._marks[chat_id] = mark
+            file.write(payload)
+            if self.durability != "none":
+                file.flush()
+            if self.durability == "fsync":
+                os.fsync(file.fileno())
+
+    def clear_samples(self, chat_id: int) -> None:
+        self.ensure_dirs()
+        with self._lock:
+            self._close_file(chat_id)
+            self._marks.pop(chat_id, None)
+            self.dialog_path(chat_id).write_text("", encoding="utf8")
+
+    def count_samples(self, chat_id: int) -> int:
+        return sum(weight for _, weight, _ in self.iter_records(chat_id))
+
+    def data_size(self, chat_id: int) -> int:
+        self.sync(chat_id)
+        try:
+            return self.dialog_path(chat_id).stat().st_size
+        except OSError:
+            return 0
+
+    def sync(self, chat_id: int) -> None:
+        with self._lock:
+            file = self._files.peek(chat_id)
+            if file is not None:
+                file.flush()
+
+    def stage_rewrite(self, chat_id: int, records: list[SampleRecord]) -> Path:
+        path = self.dialog_path(chat_id)
+        staged = path.with_name(f"{path.name}.{os.getpid()}.compact")
+        with staged.open("wb") as file:
+            file.write(encode_records(records).encode("utf8"))
+            file.flush()
+            os.fsync(file.fileno())
+        return staged
+
+    def commit_rewrite(self, chat_id: int, staged: Path, end: int) -> None:
+        self.sync(chat_id)
+        path = self.dialog_path(chat_id)
+        with path.open("rb") as source:
+            source.seek(end)
+            tail = source.read()
+        with staged.open("ab") as file:
+            if tail:
+                mark = int(time.time()) // self.mark_interval * self.mark_interval
+                file.write(f"{_TIME_MARK}{mark}\n".encode("utf8"))
+                file.write(tail)
+            file.flush()
+            os.fsync(file.fileno())
+        with self._lock:
+            self._close_file(chat_id)
+            self._marks.pop(chat_id, None)
+            os.replace(staged, path)
+
+    def discard_rewrite(self, staged: Path) -> None:
+        staged.unlink(missing_ok=True)
+
+    def load_settings(self, chat_id: int) -> Optional[dict[str, Any]]:
+        return self.settings.get(chat_id)
+
+    def save_settings(self, chat_id: int, data: dict[str, Any]) -> None:
+        self.settings.put(chat_id, data)
+
+    def iter_settings(self) -> Iterator[tuple[int, dict[str, Any]]]:
+        return self.settings.items()
+
+    def release(self, chat_id: int) -> None:
+        with self._lock:
+            self._close_file(chat_id)
+            self._marks.pop(chat_id, None)
+
+    def close(self) -> None:
+        with self._lock:
+            for chat_id in self._files.keys():
+                self._close_file(chat_id)
+        self.settings.close()
+
+    def _close_file(self, chat_id: int) -> None:
+        file = self._files.pop(chat_id)
+        if file is None:
+            return
+        file.flush()
+        if self.durability == "fsync":
+            os.fsync(file.fileno())
+        file.close()
+
+
+def open_backend(config: AppConfig) -> StorageBackend:
+    if config.storage_backend == "sqlite":
+        from .sqlite_backend import SqliteBackend
+
+        return SqliteBackend(config.sqlite_path, durability=config.journal_durability)
+    if config.storage_backend == "files":
+        return FileBackend(
+            config.dialogs_dir,
+            config.settings_dir,
+            durability=config.journal_durability,
+            settings_flush_delay=config.settings_flush_delay,
+        )
+    raise ValueError("storage_backend must be 'files' or 'sqlite'")
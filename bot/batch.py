@@ -0,0 +1,158 @@
+from __future__ import annotations
+
+from array import array
+from typing import Optional
+
+import numpy as np
+
+from .cache import LRUCache
+from .chain import _END_ID, _UNREACHABLE, ChainModel
+
+_compiled: LRUCache[int, "CompiledChain"] = LRUCache(32)
+
+
+def _copy(values: array) -> np.ndarray:
+    return np.frombuffer(values.tobytes(), dtype=np.uint32).astype(np.int64)
+
+
+class CompiledChain:
+    # First-order successor tables as CSR rows over one global cumulative
+    # weight array. The start table is the last row.
+    def __init__(self, model: ChainModel, version: int):
+        self.uid = model.uid
+        self.version = version
+        tables = [*model.transitions, model.starts]
+        present = [token_id for token_id, table in enumerate(tables) if table is not None]
+        self.start = len(tables) - 1
+        self.words = model.vocab.words
+
+        counts = np.zeros(len(tables), dtype=np.int64)
+        counts[present] = [len(tables[token_id]) for token_id in present]
+        self.offsets = np.concatenate(([0], np.cumsum(counts)))
+        self.next_ids = np.concatenate([_copy(tables[token_id].next_ids) for token_id in present])
+        self.weights = np.concatenate([_copy(tables[token_id].weights) for token_id in present])
+        cum = np.concatenate(([0], np.cumsum(self.weights)))
+        self.cum = cum[1:]
+        self.base = cum[self.offsets[:-1]]
+        self.totals = cum[self.offsets[1:]] - self.base
+        self.min_to_end = np.append(_copy(model.min_to_end), _UNREACHABLE)
+
+    def _allowed(self, candidates: np.ndarray, step: int, min_len: int, max_len: int) -> np.ndarray:
+        return np.where(
+            candidates == _END_ID,
+            step >= min_len,
+            step + 1 + self.min_to_end[candidates] <= max_len,
+        )
+
+    def _draw(self, rng: np.random.Generator, origin: np.ndarray) -> np.ndarray:
+        picks = self.base[origin] + rng.integers(0, self.totals[origin])
+        return self.next_ids[np.searchsorted(self.cum, picks, side="right")]
+
+    def _draw_allowed(
+        self,
+        rng: np.random.Generator,
+        origin: np.ndarray,
+        step: int,
+        min_len: int,
+        max_len: int,
+    ) -> np.ndarray:
+        # samples every row from its successors with disallowed ones masked
+        # out; -1 where none is allowed
+        starts = self.offsets[origin]
+        sizes = self.offsets[origin + 1] - starts
+        ends = np.cumsum(sizes)
+        flat = np.arange(ends[-1]) + np.repeat(starts - (ends - sizes), sizes)
+        candidates = self.next_ids[flat]
+        allowed = self._allowed(candidates, step, min_len, max_len)
+        cum = np.cumsum(np.where(allowed, self.weights[flat], 0))
+        base = np.concatenate(([0], cum))[ends - sizes]
+        totals = cum[ends - 1] - base
+
+        chosen = np.full(origin.size, -1, dtype=np.int64)
+        ok = totals > 0
+        picks = base[ok] + rng.integers(0, totals[ok])
+        chosen[ok] = candidates[np.searchsorted(cum, picks, side="right")]
+        return chosen
+
+    def walk(
+        self,
+        rng: np.random.Generator,
+        count: int,
+        min_len: int,
+        max_len: int,
+        attempts: int = 2,
+    ) -> list[str]:
+        # Like ChainModel.walk: a few plain draws, then a masked draw for the
+        # rows that are still rejected, so a walk only ends early when no
+        # successor fits the size bucket.
+        tokens = np.zeros((count, max_len), dtype=np.int64)
+        current = np.full(count, self.start, dtype=np.int64)
+        lengths = np.full(count, -1, dtype=np.int64)
+        rows = np.arange(count)
+
+        for step in range(max_len + 1):
+            if not rows.size:
+                break
+            origin = current[rows]
+            chosen = self._draw(rng, origin)
+            rejected = np.flatnonzero(~self._allowed(chosen, step, min_len, max_len))
+            for _ in range(attempts - 1):
+                if not rejected.size:
+                    break
+                redrawn = self._draw(rng, origin[rejected])
+                chosen[rejected] = redrawn
+                rejected = rejected[~self._allowed(redrawn, step, min_len, max_len)]
+            if rejected.size:
+                chosen[rejected] = self._draw_allowed(
+                    rng, origin[rejected], step, min_len, max_len
+                )
+
+            lengths[rows[chosen == _END_ID]] = step
+            moving = chosen > _END_ID
+            rows, chosen = rows[moving], chosen[moving]
+            if step < max_len:
+                tokens[rows, step] = chosen
+                current[rows] = chosen
+
+        words = self.words
+        return [
+            " ".join(words[token_id] for token_id in tokens[row, : lengths[row]])
+            for row in np.flatnonzero(lengths > 0)
+        ]
+
+
+def compile_chain(
+    model: ChainModel,
+    max_stale: int = 0,
+    version: Optional[int] = None,
+) -> Optional[CompiledChain]:
+    # `version` is read where the model is mutated (the event loop). Appends
+    # bump the version before they touch any table, so a compile that still
+    # sees it afterwards read a consistent model; otherwise it is discarded.
+    if version is None:
+        version = model.version
+    compiled = _compiled.get(model.uid)
+    if compiled is not None and 0 <= version - compiled.version <= max_stale:
+        return compiled
+    compiled = CompiledChain(model, version)
+    if model.version != version:
+        return None
+    _compiled.put(model.uid, compiled)
+    return compiled
+
+
+def walk_batch(
+    model: ChainModel,
+    count: int,
+    min_len: int,
+    max_len: int,
+    max_stale: int = 0,
+    version: Optional[int] = None,
+    seed: Optional[int] = None,
+) -> Optional[list[str]]:
+    if not model.starts.total:
+        return []
+    compiled = compile_chain(model, max_stale, version)
+    if compiled is None:
+        return None
+    return compiled.walk(np.random.default_rng(seed), count, min_len, max_len)
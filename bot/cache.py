@@ -0,0 +1,95 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+from typing import Callable, Generic, Hashable, Optional, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class LRUCache(Generic[K, V]):
+    def __init__(
+        self,
+        max_items: int,
+        max_bytes: int = 0,
+        sizeof: Optional[Callable[[V], int]] = None,
+        on_evict: Optional[Callable[[K, V], None]] = None,
+    ):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.on_evict = on_evict
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._items: OrderedDict[K, tuple[V, int]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __contains__(self, key: K) -> bool:
+        return key in self._items
+
+    def keys(self) -> list[K]:
+        return list(self._items)
+
+    def get(self, key: K) -> Optional[V]:
+        entry = self._items.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._items.move_to_end(key)
+        return entry[0]
+
+    def peek(self, key: K) -> Optional[V]:
+        entry = self._items.get(key)
+        return entry[0] if entry is not None else None
+
+    def put(self, key: K, value: V, size: Optional[int] = None) -> None:
+        if size is None:
+            size = self.sizeof(value) if self.sizeof is not None else 0
+        self.pop(key)
+        self._items[key] = (value, size)
+        self.total_bytes += size
+        self._evict()
+
+    def resize(self, key: K, delta: int) -> None:
+        entry = self._items.get(key)
+        if entry is None:
+            return
+        self._items[key] = (entry[0], entry[1] + delta)
+        self.total_bytes += delta
+        self._evict()
+
+    def pop(self, key: K) -> Optional[V]:
+        entry = self._items.pop(key, None)
+        if entry is None:
+            return None
+        self.total_bytes -= entry[1]
+        return entry[0]
+
+    def clear(self) -> None:
+        self._items.clear()
+        self.total_bytes = 0
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "items": len(self._items),
+            "bytes": self.total_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def _evict(self) -> None:
+        while self._items and (
+            len(self._items) > self.max_items
+            or (self.max_bytes and self.total_bytes > self.max_bytes)
+        ):
+            key, (value, size) = self._items.popitem(last=False)
+            self.total_bytes -= size
+            self.evictions += 1
+            if self.on_evict is not None:
+                self.on_evict(key, value)
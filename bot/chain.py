@@ -0,0 +1,241 @@
+from __future__ import annotations
+
+import itertools
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+from random import choices, randrange
+from sys import intern
+from typing import Callable, Iterable, Optional
+
+from .index import make_index
+
+_END = "___end___"
+_END_ID = 0
+_UNREACHABLE = 0xFFFFFFFF
+MAX_ORDER = 3
+
+_model_ids = itertools.count(1)
+
+
+class Vocabulary:
+    def __init__(self) -> None:
+        self.words: list[str] = [_END]
+        self.ids: dict[str, int] = {_END: _END_ID}
+
+    def __len__(self) -> int:
+        return len(self.words)
+
+    def intern(self, word: str) -> int:
+        token_id = self.ids.get(word)
+        if token_id is None:
+            token_id = len(self.words)
+            word = intern(word)
+            self.words.append(word)
+            self.ids[word] = token_id
+        return token_id
+
+    def decode(self, token_ids: Iterable[int]) -> list[str]:
+        words = self.words
+        return [words[token_id] for token_id in token_ids]
+
+
+class SuccessorTable:
+    __slots__ = ("next_ids", "weights", "total", "_cum")
+
+    def __init__(self) -> None:
+        self.next_ids = array("I")
+        self.weights = array("I")
+        self.total = 0
+        self._cum: Optional[array] = None
+
+    def __len__(self) -> int:
+        return len(self.next_ids)
+
+    def __getstate__(self) -> tuple[array, array, int]:
+        return self.next_ids, self.weights, self.total
+
+    def __setstate__(self, state: tuple[array, array, int]) -> None:
+        self.next_ids, self.weights, self.total = state
+        self._cum = None
+
+    def add(self, next_id: int, weight: int = 1) -> None:
+        next_ids = self.next_ids
+        index = bisect_left(next_ids, next_id)
+        if index < len(next_ids) and next_ids[index] == next_id:
+            self.weights[index] += weight
+        else:
+            next_ids.insert(index, next_id)
+            self.weights.insert(index, weight)
+        self.total += weight
+        self._cum = None
+
+    def sample(self) -> int:
+        cum = self._cum
+        if cum is None:
+            cum = self._cum = array("Q", accumulate(self.weights))
+        # bounded by `cum` itself, not `total`, so a concurrent add() cannot
+        # push the draw past its end
+        return self.next_ids[bisect_right(cum, randrange(cum[-1]))]
+
+    def sample_where(self, allowed: Callable[[int], bool], attempts: int = 4) -> Optional[int]:
+        for _ in range(attempts):
+            next_id = self.sample()
+            if allowed(next_id):
+                return next_id
+
+        candidates = [
+            (next_id, weight)
+            for next_id, weight in zip(self.next_ids, self.weights)
+            if allowed(next_id)
+        ]
+        if not candidates:
+            return None
+        next_ids, weights = zip(*candidates)
+        return choices(next_ids, weights)[0]
+
+
+def _context_key(token_ids: Iterable[int]) -> int:
+    key = 0
+    for token_id in token_ids:
+        key = (key << 32) | token_id
+    return key
+
+
+class ChainModel:
+    def __init__(self, index_kind: str = "exact", order: int = 1) -> None:
+        if not 1 <= order <= MAX_ORDER:
+            raise ValueError(f"order must be between 1 and {MAX_ORDER}")
+        self.uid = next(_model_ids)
+        self.order = order
+        self.index_kind = index_kind
+        self.version = 0
+        self.sample_count = 0
+        self.vocab = Vocabulary()
+        self.starts = SuccessorTable()
+        self.transitions: list[Optional[SuccessorTable]] = [None]
+        self.contexts: list[dict[int, SuccessorTable]] = [{} for _ in range(order - 1)]
+        self.min_to_end = array("I", [0])
+        self.index = make_index(index_kind)
+
+    @classmethod
+    def from_samples(
+        cls,
+        samples: Iterable[str],
+        index_kind: str = "exact",
+        order: int = 1,
+    ) -> "ChainModel":
+        return cls.from_weighted(((sample, 1) for sample in samples), index_kind, order)
+
+    @classmethod
+    def from_weighted(
+        cls,
+        samples: Iterable[tuple[str, int]],
+        index_kind: str = "exact",
+        order: int = 1,
+    ) -> "ChainModel":
+        model = cls(index_kind, order)
+        for sample, weight in samples:
+            model.add_sample(sample, weight)
+        model.refresh_lengths()
+        return model
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self.uid = next(_model_ids)
+
+    def add_sample(self, sample: str, weight: int = 1) -> None:
+        words = sample.split()
+        if not words or weight <= 0:
+            return
+
+        self.version += 1
+        self.sample_count += weight
+        self.index.add(sample)
+
+        token_ids = [self.vocab.intern(word) for word in words]
+        missing = len(self.vocab) - len(self.transitions)
+        if missing > 0:
+            self.transitions.extend([None] * missing)
+            self.min_to_end.extend([_UNREACHABLE] * missing)
+
+        self.starts.add(token_ids[0], weight)
+        for cur, nxt in zip(token_ids, [*token_ids[1:], _END_ID]):
+            table = self.transitions[cur]
+            if table is None:
+                table = self.transitions[cur] = SuccessorTable()
+            table.add(nxt, weight)
+
+        for context_len, contexts in enumerate(self.contexts, start=2):
+            for end in range(context_len, len(token_ids) + 1):
+                key = _context_key(token_ids[end - context_len:end])
+                table = contexts.get(key)
+                if table is None:
+                    table = contexts[key] = SuccessorTable()
+                table.add(token_ids[end] if end < len(token_ids) else _END_ID, weight)
+
+        min_to_end = self.min_to_end
+        steps = 0
+        for token_id in reversed(token_ids):
+            if steps < min_to_end[token_id]:
+                min_to_end[token_id] = steps
+            else:
+                steps = min_to_end[token_id]
+            steps += 1
+
+    def refresh_lengths(self) -> None:
+        predecessors: list[list[int]] = [[] for _ in self.transitions]
+        for token_id, table in enumerate(self.transitions):
+            if table is not None:
+                for next_id in table.next_ids:
+                    predecessors[next_id].append(token_id)
+
+        min_to_end = array("I", [_UNREACHABLE]) * len(self.transitions)
+        min_to_end[_END_ID] = 0
+        frontier = predecessors[_END_ID]
+        steps = 0
+        while frontier:
+            next_frontier = []
+            for token_id in frontier:
+                if min_to_end[token_id] == _UNREACHABLE:
+                    min_to_end[token_id] = steps
+                    next_frontier.extend(predecessors[token_id])
+            frontier = next_frontier
+            steps += 1
+        self.min_to_end = min_to_end
+
+    def walk(self, min_len: int = 1, max_len: int = 100) -> Optional[list[str]]:
+        if not self.starts.total:
+            return None
+
+        transitions = self.transitions
+        min_to_end = self.min_to_end
+        result: list[int] = []
+
+        def allowed(next_id: int) -> bool:
+            n = len(result)
+            if next_id == _END_ID:
+                return n >= min_len
+            return n + 1 + min_to_end[next_id] <= max_len
+
+        nxt = self.starts.sample_where(allowed)
+        while nxt is not None:
+            if nxt == _END_ID:
+                return self.vocab.decode(result)
+            result.append(nxt)
+
+            nxt = None
+            for context_len in range(min(self.order, len(result)), 1, -1):
+                table = self.contexts[context_len - 2].get(_context_key(result[-context_len:]))
+                if table is not None:
+                    nxt = table.sample_where(allowed)
+                    if nxt is not None:
+                        break
+            if nxt is None:
+                table = transitions[result[-1]]
+                if table is not None:
+                    nxt = table.sample_where(allowed)
+        return None
+
+    def is_known(self, text: str) -> bool:
+        return text in self.index
@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import os
+import tempfile
 from dataclasses import dataclass
 from pathlib import Path
 
@@ -29,6 +30,60 @@ class AppConfig:
     token: str
     dialogs_dir: Path
     settings_dir: Path
+    storage_backend: str = "files"
+    sqlite_path: Path = Path("Dialogs/witless.sqlite3")
+    cache_max_chats: int = 1024
+    cache_max_bytes: int = 64 * 1024 * 1024
+    chat_idle_ttl: float = 3600.0
+    chat_sweep_interval: float = 60.0
+    storage_io_workers: int = 4
+    gen_pool_type: str = "thread"
+    gen_pool_size: int = 2
+    gen_max_inflight_per_chat: int = 1
+    gen_max_inflight: int = 32
+    gen_payload_max_stale: int = 50
+    send_global_rate: float = 30.0
+    send_global_burst: float = 30.0
+    send_chat_rate: float = 1 / 3
+    send_chat_burst: float = 3.0
+    send_queue_size: int = 1000
+    send_max_retries: int = 3
+    auto_reply_ttl: float = 15.0
+    reply_pool_size: int = 4
+    reply_pool_max_chats: int = 256
+    reply_pool_refill_rate: float = 5.0
+    reply_pool_max_age: float = 600.0
+    reply_pool_max_stale: int = 50
+    reply_pool_idle_after: float = 300.0
+    journal_durability: str = "flush"
+    journal_max_batch: int = 256
+    journal_flush_interval: float = 1.0
+    settings_flush_delay: float = 0.5
+    novelty_index: str = "exact"
+    snapshot_dir: Path = Path("Dialogs/models")
+    snapshot_every: int = 1000
+    compact_every: int = 5000
+    metrics_host: str = "127.0.0.1"
+    metrics_port: int = 0
+    metrics_log_interval: float = 0.0
+    run_mode: str = "polling"
+    webhook_url: str = ""
+    webhook_path: str = "/webhook"
+    webhook_host: str = "0.0.0.0"
+    webhook_port: int = 8080
+    webhook_secret: str = ""
+    webhook_max_concurrency: int = 64
+    webhook_drain_timeout: float = 30.0
+    workers: int = 1
+    shard_socket_dir: Path = Path(tempfile.gettempdir()) / "witless"
+    shard_start_timeout: float = 30.0
+    shard_stop_timeout: float = 30.0
+    fsm_storage: str = "memory"
+    settings_cache: str = "memory"
+    redis_url: str = "redis://localhost:6379/0"
+    redis_prefix: str = "witless"
+    redis_fsm_ttl: int = 86400
+    redis_settings_ttl: int = 3600
 
     @classmethod
     def from_env(cls) -> "AppConfig":
@@ -38,4 +93,60 @@ class AppConfig:
             token=os.getenv("TELEGRAM_TOKEN", ""),
             dialogs_dir=base_dir / "dialogs",
             settings_dir=base_dir / "settings",
+            storage_backend=os.getenv("STORAGE_BACKEND", "files"),
+            sqlite_path=Path(os.getenv("SQLITE_PATH", str(base_dir / "witless.sqlite3"))),
+            cache_max_chats=int(os.getenv("CACHE_MAX_CHATS", "1024")),
+            cache_max_bytes=int(os.getenv("CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+            chat_idle_ttl=float(os.getenv("CHAT_IDLE_TTL", "3600")),
+            chat_sweep_interval=float(os.getenv("CHAT_SWEEP_INTERVAL", "60")),
+            storage_io_workers=int(os.getenv("STORAGE_IO_WORKERS", "4")),
+            gen_pool_type=os.getenv("GEN_POOL_TYPE", "thread"),
+            gen_pool_size=int(os.getenv("GEN_POOL_SIZE", "2")),
+            gen_max_inflight_per_chat=int(os.getenv("GEN_MAX_INFLIGHT_PER_CHAT", "1")),
+            gen_max_inflight=int(os.getenv("GEN_MAX_INFLIGHT", "32")),
+            gen_payload_max_stale=int(os.getenv("GEN_PAYLOAD_MAX_STALE", "50")),
+            send_global_rate=float(os.getenv("SEND_GLOBAL_RATE", "30")),
+            send_global_burst=float(os.getenv("SEND_GLOBAL_BURST", "30")),
+            send_chat_rate=float(os.getenv("SEND_CHAT_RATE", str(1 / 3))),
+            send_chat_burst=float(os.getenv("SEND_CHAT_BURST", "3")),
+            send_queue_size=int(os.getenv("SEND_QUEUE_SIZE", "1000")),
+            send_max_retries=int(os.getenv("SEND_MAX_RETRIES", "3")),
+            auto_reply_ttl=float(os.getenv("AUTO_REPLY_TTL", "15")),
+            reply_pool_size=int(os.getenv("REPLY_POOL_SIZE", "4")),
+            reply_pool_max_chats=int(os.getenv("REPLY_POOL_MAX_CHATS", "256")),
+            reply_pool_refill_rate=float(os.getenv("REPLY_POOL_REFILL_RATE", "5")),
+            reply_pool_max_age=float(os.getenv("REPLY_POOL_MAX_AGE", "600")),
+            reply_pool_max_stale=int(os.getenv("REPLY_POOL_MAX_STALE", "50")),
+            reply_pool_idle_after=float(os.getenv("REPLY_POOL_IDLE_AFTER", "300")),
+            journal_durability=os.getenv("JOURNAL_DURABILITY", "flush"),
+            journal_max_batch=int(os.getenv("JOURNAL_MAX_BATCH", "256")),
+            journal_flush_interval=float(os.getenv("JOURNAL_FLUSH_INTERVAL", "1.0")),
+            settings_flush_delay=float(os.getenv("SETTINGS_FLUSH_DELAY", "0.5")),
+            novelty_index=os.getenv("NOVELTY_INDEX", "exact"),
+            snapshot_dir=base_dir / "models",
+            snapshot_every=int(os.getenv("SNAPSHOT_EVERY", "1000")),
+            compact_every=int(os.getenv("COMPACT_EVERY", "5000")),
+            metrics_host=os.getenv("METRICS_HOST", "127.0.0.1"),
+            metrics_port=int(os.getenv("METRICS_PORT", "0")),
+            metrics_log_interval=float(os.getenv("METRICS_LOG_INTERVAL", "0")),
+            run_mode=os.getenv("RUN_MODE", "polling"),
+            webhook_url=os.getenv("WEBHOOK_URL", ""),
+            webhook_path=os.getenv("WEBHOOK_PATH", "/webhook"),
+            webhook_host=os.getenv("WEBHOOK_HOST", "0.0.0.0"),
+            webhook_port=int(os.getenv("WEBHOOK_PORT", "8080")),
+            webhook_secret=os.getenv("WEBHOOK_SECRET", ""),
+            webhook_max_concurrency=int(os.getenv("WEBHOOK_MAX_CONCURRENCY", "64")),
+            webhook_drain_timeout=float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "30")),
+            workers=int(os.getenv("WORKERS", "1")),
+            shard_socket_dir=Path(
+                os.getenv("SHARD_SOCKET_DIR", str(Path(tempfile.gettempdir()) / "witless"))
+            ),
+            shard_start_timeout=float(os.getenv("SHARD_START_TIMEOUT", "30")),
+            shard_stop_timeout=float(os.getenv("SHARD_STOP_TIMEOUT", "30")),
+            fsm_storage=os.getenv("FSM_STORAGE", "memory"),
+            settings_cache=os.getenv("SETTINGS_CACHE", "memory"),
+            redis_url=os.getenv("REDIS_URL", "redis://localhost:6379/0"),
+            redis_prefix=os.getenv("REDIS_PREFIX", "witless"),
+            redis_fsm_ttl=int(os.getenv("REDIS_FSM_TTL", "86400")),
+            redis_settings_ttl=int(os.getenv("REDIS_SETTINGS_TTL", "3600")),
         )
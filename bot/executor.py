@@ -0,0 +1,231 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import pickle
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, ContextManager, Optional
+
+from .cache import LRUCache
+from .chain import ChainModel
+from .metrics import GENERATE_LATENCY, GENERATE_RESULTS, GENERATE_TRIES
+from .textgen import generate_batch_counted, generate_counted
+
+logger = logging.getLogger(__name__)
+
+_worker_models: LRUCache[int, tuple[tuple[int, int], ChainModel]] = LRUCache(8)
+
+
+def _generate_pickled(
+    work: Callable[..., tuple[Any, int]],
+    chat_id: int,
+    key: tuple[int, int],
+    payload: bytes,
+    *args: Optional[int],
+) -> tuple[Any, int]:
+    cached = _worker_models.get(chat_id)
+    if cached is None or cached[0] != key:
+        cached = (key, pickle.loads(payload))
+        _worker_models.put(chat_id, cached)
+    return work(cached[1], *args)
+
+
+class GenerationExecutor:
+    def __init__(
+        self,
+        pool_type: str = "thread",
+        pool_size: int = 2,
+        max_inflight_per_chat: int = 1,
+        max_inflight: int = 32,
+        payload_max_stale: int = 50,
+        hold: Optional[Callable[[int, ChainModel], ContextManager[None]]] = None,
+    ):
+        if pool_type not in ("thread", "process"):
+            raise ValueError("pool_type must be 'thread' or 'process'")
+        self.pool_type = pool_type
+        self.max_inflight_per_chat = max_inflight_per_chat
+        self.max_inflight = max_inflight
+        self.payload_max_stale = payload_max_stale
+        # keeps the loop from appending to a chain while a worker thread reads it
+        self._hold = hold
+        self.dropped = 0
+        self.coalesced = 0
+        self._pool: Executor
+        if pool_type == "process":
+            self._pool = ProcessPoolExecutor(max_workers=pool_size)
+        else:
+            self._pool = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="textgen")
+        # per chat: size, whether it was explicit, and the job
+        self._inflight: dict[int, list[tuple[int, bool, asyncio.Future]]] = {}
+        self._inflight_total = 0
+        self._payloads: LRUCache[int, tuple[tuple[int, int], bytes]] = LRUCache(pool_size * 4)
+        self._pickling: dict[int, asyncio.Task] = {}
+
+    async def generate(
+        self,
+        chat_id: int,
+        model: ChainModel,
+        tries_count: int = 200,
+        size: int = 0,
+        explicit: bool = False,
+    ) -> Optional[str]:
+        # Explicit requests (commands) are not turned away by the per-chat cap
+        # and never share another request's text. Only when a cap is reached
+        # does an implicit one join a pending implicit job of the same size.
+        jobs = self._inflight.get(chat_id, [])
+        chat_full = len(jobs) >= self.max_inflight_per_chat and not explicit
+        if chat_full or self._inflight_total >= self.max_inflight:
+            pending = None
+            for job_size, by_command, job in jobs:
+                if job_size == size and not (explicit or by_command):
+                    pending = job
+                    break
+            if pending is not None:
+                self.coalesced += 1
+                GENERATE_RESULTS.inc(outcome="coalesced")
+                return (await asyncio.shield(pending))[0]
+            self.dropped += 1
+            GENERATE_RESULTS.inc(outcome="dropped")
+            return None
+
+        started = time.perf_counter()
+        future = self._submit(chat_id, model, generate_counted, tries_count, size)
+        job = (size, explicit, future)
+        self._inflight.setdefault(chat_id, []).append(job)
+        self._inflight_total += 1
+        future.add_done_callback(lambda done: self._release(chat_id, job, started))
+        return (await asyncio.shield(future))[0]
+
+    @property
+    def idle(self) -> bool:
+        return self._inflight_total == 0
+
+    async def prefill(
+        self,
+        chat_id: int,
+        model: ChainModel,
+        count: int,
+        tries_count: int = 200,
+        size: int = 0,
+    ) -> list[str]:
+        # Background work: only runs on an idle pool and never occupies the
+        # per-chat slot, so live requests are not coalesced onto it or dropped.
+        if not self.idle:
+            return []
+        started = time.perf_counter()
+        # threads share the model, a process gets a copy nothing appends to
+        version = model.version if self.pool_type == "thread" else None
+        future = self._submit(
+            chat_id, model, generate_batch_counted, count, tries_count, size, version
+        )
+        self._inflight_total += 1
+        future.add_done_callback(lambda done: self._observe(size, done, started))
+        return (await asyncio.shield(future))[0]
+
+    def shutdown(self) -> None:
+        for task in self._pickling.values():
+            task.cancel()
+        self._pool.shutdown(wait=True, cancel_futures=True)
+
+    def _observe(self, size: int, done: asyncio.Future, started: float) -> None:
+        self._inflight_total -= 1
+        if not done.cancelled() and done.exception() is None:
+            out, tries = done.result()
+            GENERATE_LATENCY.observe(time.perf_counter() - started, size=size)
+            GENERATE_TRIES.observe(tries, size=size)
+            GENERATE_RESULTS.inc(outcome="ok" if out else "empty")
+
+    def _release(
+        self,
+        chat_id: int,
+        job: tuple[int, bool, asyncio.Future],
+        started: float,
+    ) -> None:
+        size, _, done = job
+        self._observe(size, done, started)
+        jobs = self._inflight.get(chat_id)
+        if jobs is None:
+            return
+        jobs.remove(job)
+        if not jobs:
+            del self._inflight[chat_id]
+
+    def _submit(
+        self,
+        chat_id: int,
+        model: ChainModel,
+        work: Callable[..., tuple[Any, int]],
+        *args: Optional[int],
+    ) -> asyncio.Future:
+        if self.pool_type == "thread":
+            if self._hold is None:
+                return asyncio.get_running_loop().run_in_executor(self._pool, work, model, *args)
+            held = self._hold(chat_id, model)
+            return asyncio.ensure_future(self._submit_held(held, model, work, *args))
+        return asyncio.ensure_future(self._submit_pickled(chat_id, model, work, *args))
+
+    async def _submit_held(
+        self,
+        held: ContextManager[None],
+        model: ChainModel,
+        work: Callable[..., tuple[Any, int]],
+        *args: Optional[int],
+    ) -> tuple[Any, int]:
+        with held:
+            return await asyncio.get_running_loop().run_in_executor(
+                self._pool, work, model, *args
+            )
+
+    async def _submit_pickled(
+        self,
+        chat_id: int,
+        model: ChainModel,
+        work: Callable[..., tuple[Any, int]],
+        *args: Optional[int],
+    ) -> tuple[Any, int]:
+        key, payload = await self._payload(chat_id, model)
+        return await asyncio.get_running_loop().run_in_executor(
+            self._pool, _generate_pickled, work, chat_id, key, payload, *args
+        )
+
+    async def _payload(self, chat_id: int, model: ChainModel) -> tuple[tuple[int, int], bytes]:
+        # Workers may run on a copy up to `payload_max_stale` appends old, so a
+        # busy chat is re-pickled at most once per half that many appends.
+        cached = self._payloads.get(chat_id)
+        if cached is not None and cached[0][0] == model.uid:
+            behind = model.version - cached[0][1]
+            if 0 <= behind <= self.payload_max_stale:
+                if behind > self.payload_max_stale // 2:
+                    self._repickle(chat_id, model)
+                return cached
+        while True:
+            # a dump still running for a model the chat has since replaced
+            # is finished first
+            cached = await asyncio.shield(self._repickle(chat_id, model))
+            if cached[0][0] == model.uid:
+                return cached
+
+    def _repickle(self, chat_id: int, model: ChainModel) -> asyncio.Task:
+        task = self._pickling.get(chat_id)
+        if task is None:
+            task = asyncio.ensure_future(self._pickle(chat_id, model))
+            self._pickling[chat_id] = task
+            task.add_done_callback(lambda done: self._pickled(chat_id, done))
+        return task
+
+    def _pickled(self, chat_id: int, done: asyncio.Task) -> None:
+        self._pickling.pop(chat_id, None)
+        if not done.cancelled() and done.exception() is not None:
+            logger.error("Failed to pickle chat %s", chat_id, exc_info=done.exception())
+
+    async def _pickle(self, chat_id: int, model: ChainModel) -> tuple[tuple[int, int], bytes]:
+        version = model.version
+        if self._hold is not None:
+            with self._hold(chat_id, model):
+                payload = await asyncio.to_thread(pickle.dumps, model, pickle.HIGHEST_PROTOCOL)
+        else:
+            payload = pickle.dumps(model, protocol=pickle.HIGHEST_PROTOCOL)
+        cached = ((model.uid, version), payload)
+        self._payloads.put(chat_id, cached)
+        return cached
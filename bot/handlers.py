@@ -1,21 +1,32 @@
 from __future__ import annotations
 
 import random
+from typing import Optional
 
 from aiogram import F, Router
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.types import CallbackQuery, ChatMemberUpdated, Message
 
+from .chain import MAX_ORDER
 from .config import HELP_MESSAGE, KAK_MESSAGE, MEETING_MESSAGE
+from .executor import GenerationExecutor
 from .keyboards import clear_confirm_kb, gen_kb, settings_kb
+from .metrics import AUTO_REPLIES
+from .outbox import PRIORITY_AUTO_REPLY, PRIORITY_COMMAND, SendScheduler
+from .replypool import ReplyPool
 from .services import callback_chat_id, is_admin
 from .states import SettingsForm
 from .storage import ChatStorage
-from .textgen import generate, is_allowed_text, maybe_caps, parse_size_arg
+from .textgen import is_allowed_text, maybe_caps, parse_size_arg
 
 
-def build_router(storage: ChatStorage) -> Router:
+def build_router(
+    storage: ChatStorage,
+    generator: GenerationExecutor,
+    outbox: SendScheduler,
+    replies: ReplyPool,
+) -> Router:
     router = Router()
 
     @router.my_chat_member()
@@ -26,8 +37,8 @@ def build_router(storage: ChatStorage) -> Router:
             return
         if update.new_chat_member.status in ("member", "administrator", "creator"):
             chat_id = update.chat.id
-            storage.ensure_chat(chat_id)
-            storage.load_settings(chat_id)
+            storage.activate(chat_id)
+            await storage.aload_settings(chat_id)
             try:
                 await update.bot.send_message(chat_id, MEETING_MESSAGE)
             except Exception:
@@ -39,41 +50,37 @@ def build_router(storage: ChatStorage) -> Router:
             user.is_bot and user.id == message.bot.id for user in message.new_chat_members
         ):
             chat_id = message.chat.id
-            storage.ensure_chat(chat_id)
-            storage.load_settings(chat_id)
+            storage.activate(chat_id)
+            await storage.aload_settings(chat_id)
             await message.answer(MEETING_MESSAGE)
 
     @router.message(Command("help"))
     async def cmd_help(message: Message):
-        storage.ensure_chat(message.chat.id)
+        storage.activate(message.chat.id)
         await message.answer(HELP_MESSAGE)
 
     @router.message(F.text == "как")
     async def msg_kak(message: Message):
-        storage.ensure_chat(message.chat.id)
+        storage.activate(message.chat.id)
         await message.answer(KAK_MESSAGE)
 
     @router.message(Command("settings"))
     async def cmd_settings(message: Message):
-        storage.ensure_chat(message.chat.id)
-        settings = storage.load_settings(message.chat.id)
+        storage.activate(message.chat.id)
+        settings = await storage.aload_settings(message.chat.id)
         await message.answer("⚙ Настройки чата:", reply_markup=settings_kb(settings))
 
     @router.message(Command("info"))
     async def cmd_info(message: Message):
-        storage.ensure_chat(message.chat.id)
-        samples = storage.load_samples(message.chat.id)
+        storage.activate(message.chat.id)
+        count = await storage.acount_samples(message.chat.id)
 
-        try:
-            size = storage.dialog_path(message.chat.id).stat().st_size
-        except Exception:
-            size = 0
-
-        await message.answer(f"сохранил фраз: {len(samples)}\nразмер файла: {size} байт")
+        size = await storage.adialog_size(message.chat.id)
+        await message.answer(f"сохранил фраз: {count}\nразмер файла: {size} байт")
 
     @router.message(Command("clear"))
     async def cmd_clear(message: Message):
-        storage.ensure_chat(message.chat.id)
+        storage.activate(message.chat.id)
         if message.from_user is None:
             await message.answer("Не могу определить пользователя.")
             return
@@ -86,8 +93,8 @@ def build_router(storage: ChatStorage) -> Router:
 
     @router.message(Command("gen"))
     async def cmd_gen(message: Message):
-        storage.ensure_chat(message.chat.id)
-        settings = storage.load_settings(message.chat.id)
+        storage.activate(message.chat.id)
+        settings = await storage.aload_settings(message.chat.id)
 
         arg = None
         if message.text:
@@ -96,13 +103,18 @@ def build_router(storage: ChatStorage) -> Router:
                 arg = parts[1]
 
         size = parse_size_arg(arg) if arg else settings.default_gen_size
-        samples = storage.load_samples(message.chat.id)
-        if len(samples) < settings.min_samples:
+        model = await storage.achain(message.chat.id, settings.chain_order)
+        if model.sample_count < settings.min_samples:
             await message.answer(f"Недостаточно фраз для генерации (минимум {settings.min_samples})")
             return
 
-        out = generate(samples, tries_count=300, size=size)
-        await message.answer(maybe_caps((out or "че").lower()))
+        async def produce() -> str:
+            out = replies.take(message.chat.id, model, size) or await generator.generate(
+                message.chat.id, model, tries_count=300, size=size, explicit=True
+            )
+            return maybe_caps((out or "че").lower())
+
+        outbox.submit(message.chat.id, PRIORITY_COMMAND, produce, message.answer)
 
     @router.callback_query(F.data == "set:refresh")
     async def cb_refresh(call: CallbackQuery, state: FSMContext):
@@ -111,7 +123,7 @@ def build_router(storage: ChatStorage) -> Router:
             await call.answer()
             return
         await state.clear()
-        settings = storage.load_settings(chat_id)
+        settings = await storage.aload_settings(chat_id)
         await call.message.edit_text("⚙ Настройки чата:", reply_markup=settings_kb(settings))
         await call.answer()
 
@@ -130,9 +142,21 @@ def build_router(storage: ChatStorage) -> Router:
         if chat_id is None or call.message is None:
             await call.answer()
             return
-        settings = storage.load_settings(chat_id)
+        settings = await storage.aload_settings(chat_id)
         settings.auto_reply_enabled = not settings.auto_reply_enabled
-        storage.save_settings(chat_id, settings)
+        await storage.asave_settings(chat_id, settings)
+        await call.message.edit_text("⚙ Настройки чата:", reply_markup=settings_kb(settings))
+        await call.answer("Ок")
+
+    @router.callback_query(F.data == "set:order")
+    async def cb_order(call: CallbackQuery):
+        chat_id = callback_chat_id(call)
+        if chat_id is None or call.message is None:
+            await call.answer()
+            return
+        settings = await storage.aload_settings(chat_id)
+        settings.chain_order = settings.chain_order % MAX_ORDER + 1
+        await storage.asave_settings(chat_id, settings)
         await call.message.edit_text("⚙ Настройки чата:", reply_markup=settings_kb(settings))
         await call.answer("Ок")
 
@@ -168,6 +192,22 @@ def build_router(storage: ChatStorage) -> Router:
         await call.answer()
         await call.message.answer("Введи минимум фраз для генерации. Допустимо 2..200")
 
+    @router.callback_query(F.data == "set:retention")
+    async def cb_set_retention(call: CallbackQuery, state: FSMContext):
+        chat_id = callback_chat_id(call)
+        if chat_id is None or call.message is None:
+            await call.answer()
+            return
+        if call.from_user is None or not await is_admin(call.bot, chat_id, call.from_user.id):
+            await call.answer("Нужны права администратора", show_alert=True)
+            return
+        await state.set_state(SettingsForm.waiting_retention)
+        await call.answer()
+        await call.message.answer(
+            "Введи лимиты хранения через пробел: фраз, КБ, дней.\n"
+            "0 — без лимита. Пример: 20000 0 90"
+        )
+
     @router.callback_query(F.data == "set:defsize")
     async def cb_defsize(call: CallbackQuery):
         if call.message is None:
@@ -191,19 +231,25 @@ def build_router(storage: ChatStorage) -> Router:
             await call.answer()
             return
 
-        settings = storage.load_settings(chat_id)
+        settings = await storage.aload_settings(chat_id)
         try:
             size = int(call.data.split(":")[1])
         except Exception:
             size = settings.default_gen_size
 
-        samples = storage.load_samples(chat_id)
-        if len(samples) < settings.min_samples:
+        model = await storage.achain(chat_id, settings.chain_order)
+        if model.sample_count < settings.min_samples:
             await call.answer("Мало фраз", show_alert=True)
             return
 
-        out = generate(samples, tries_count=300, size=size) or "че"
-        await call.message.answer(maybe_caps(out.lower()))
+        async def produce() -> str:
+            out = replies.take(chat_id, model, size) or await generator.generate(
+                chat_id, model, tries_count=300, size=size, explicit=True
+            )
+            out = out or "че"
+            return maybe_caps(out.lower())
+
+        outbox.submit(chat_id, PRIORITY_COMMAND, produce, call.message.answer)
         await call.answer("Готово")
 
     @router.callback_query(F.data == "clear:confirm")
@@ -227,7 +273,7 @@ def build_router(storage: ChatStorage) -> Router:
             await call.answer("Нужны права администратора", show_alert=True)
             return
 
-        storage.clear_samples(chat_id)
+        await storage.aclear_samples(chat_id)
         await call.message.answer("База очищена ✅")
         await call.answer()
 
@@ -244,9 +290,9 @@ def build_router(storage: ChatStorage) -> Router:
             await message.answer("Диапазон 1..20")
             return
 
-        settings = storage.load_settings(chat_id)
+        settings = await storage.aload_settings(chat_id)
         settings.auto_reply_chance_n = value
-        storage.save_settings(chat_id, settings)
+        await storage.asave_settings(chat_id, settings)
         await state.clear()
         await message.answer("Готово ✅")
         await message.answer("⚙ Настройки чата:", reply_markup=settings_kb(settings))
@@ -264,9 +310,9 @@ def build_router(storage: ChatStorage) -> Router:
             await message.answer("Диапазон 10..400")
             return
 
-        settings = storage.load_settings(chat_id)
+        settings = await storage.aload_settings(chat_id)
         settings.max_store_text_len = value
-        storage.save_settings(chat_id, settings)
+        await storage.asave_settings(chat_id, settings)
         await state.clear()
         await message.answer("Готово ✅")
         await message.answer("⚙ Настройки чата:", reply_markup=settings_kb(settings))
@@ -284,18 +330,43 @@ def build_router(storage: ChatStorage) -> Router:
             await message.answer("Диапазон 2..200")
             return
 
-        settings = storage.load_settings(chat_id)
+        settings = await storage.aload_settings(chat_id)
         settings.min_samples = value
-        storage.save_settings(chat_id, settings)
+        await storage.asave_settings(chat_id, settings)
+        await state.clear()
+        await message.answer("Готово ✅")
+        await message.answer("⚙ Настройки чата:", reply_markup=settings_kb(settings))
+
+    @router.message(SettingsForm.waiting_retention)
+    async def on_retention_input(message: Message, state: FSMContext):
+        chat_id = message.chat.id
+        try:
+            values = [int(part) for part in message.text.split()]
+        except Exception:
+            await message.answer("Нужно три числа. Пример: 20000 0 90")
+            return
+
+        if len(values) != 3 or any(value < 0 for value in values):
+            await message.answer("Нужно три неотрицательных числа. Пример: 20000 0 90")
+            return
+
+        settings = await storage.aload_settings(chat_id)
+        (
+            settings.retention_max_lines,
+            settings.retention_max_kb,
+            settings.retention_max_days,
+        ) = values
+        await storage.asave_settings(chat_id, settings)
         await state.clear()
+        storage.schedule_compaction(chat_id)
         await message.answer("Готово ✅")
         await message.answer("⚙ Настройки чата:", reply_markup=settings_kb(settings))
 
     @router.message()
     async def on_message(message: Message):
         chat_id = message.chat.id
-        storage.ensure_chat(chat_id)
-        settings = storage.load_settings(chat_id)
+        storage.activate(chat_id)
+        settings = await storage.aload_settings(chat_id)
 
         if message.text is None or message.from_user is None:
             return
@@ -308,12 +379,20 @@ def build_router(storage: ChatStorage) -> Router:
         if random.randint(1, settings.auto_reply_chance_n) != 1:
             return
 
-        samples = storage.load_samples(chat_id)
-        if len(samples) < settings.min_samples:
-            return
+        async def produce() -> Optional[str]:
+            model = await storage.achain(chat_id, settings.chain_order)
+            if model.sample_count < settings.min_samples:
+                return None
+            size = settings.default_gen_size
+            out = replies.take(chat_id, model, size) or await generator.generate(
+                chat_id, model, tries_count=200, size=size
+            )
+            return maybe_caps(out.lower()) if out else None
+
+        async def reply(text: str) -> None:
+            await message.answer(text)
+            AUTO_REPLIES.inc()
 
-        out = generate(samples, tries_count=200, size=settings.default_gen_size)
-        if out:
-            await message.answer(maybe_caps(out.lower()))
+        outbox.submit(chat_id, PRIORITY_AUTO_REPLY, produce, reply)
 
     return router
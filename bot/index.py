@@ -0,0 +1,102 @@
+from __future__ import annotations
+
+import math
+from hashlib import blake2b
+from typing import Protocol
+
+INDEX_KINDS = ("exact", "bloom")
+
+
+def normalize_sample(text: str) -> str:
+    return " ".join(text.casefold().split())
+
+
+def _digest(text: str) -> bytes:
+    return blake2b(normalize_sample(text).encode("utf8"), digest_size=16).digest()
+
+
+class SampleIndex(Protocol):
+    def add(self, text: str) -> None: ...
+
+    def __contains__(self, text: object) -> bool: ...
+
+    def __len__(self) -> int: ...
+
+
+class ExactIndex:
+    def __init__(self) -> None:
+        self._hashes: set[int] = set()
+
+    def __len__(self) -> int:
+        return len(self._hashes)
+
+    def __contains__(self, text: object) -> bool:
+        return isinstance(text, str) and int.from_bytes(_digest(text)[:8], "little") in self._hashes
+
+    def add(self, text: str) -> None:
+        self._hashes.add(int.from_bytes(_digest(text)[:8], "little"))
+
+
+class _BloomStage:
+    __slots__ = ("capacity", "count", "bits_count", "hashes_count", "bits")
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = capacity
+        self.count = 0
+        self.bits_count = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes_count = max(1, round(self.bits_count / capacity * math.log(2)))
+        self.bits = bytearray((self.bits_count + 7) // 8)
+
+    def positions(self, digest: bytes) -> list[int]:
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.bits_count for i in range(self.hashes_count)]
+
+    def add(self, digest: bytes) -> None:
+        for pos in self.positions(digest):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, digest: bytes) -> bool:
+        bits = self.bits
+        return all(bits[pos >> 3] & (1 << (pos & 7)) for pos in self.positions(digest))
+
+
+class BloomIndex:
+    def __init__(self, capacity: int = 1024, error_rate: float = 0.001):
+        self.error_rate = error_rate
+        self._count = 0
+        self._stages = [_BloomStage(capacity, error_rate / 2)]
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __contains__(self, text: object) -> bool:
+        if not isinstance(text, str):
+            return False
+        digest = _digest(text)
+        return any(digest in stage for stage in self._stages)
+
+    def add(self, text: str) -> None:
+        digest = _digest(text)
+        if any(digest in stage for stage in self._stages):
+            return
+        stage = self._stages[-1]
+        if stage.count >= stage.capacity:
+            tightening = 2 ** (len(self._stages) + 1)
+            stage = _BloomStage(stage.capacity * 2, self.error_rate / tightening)
+            self._stages.append(stage)
+        stage.add(digest)
+        self._count += 1
+
+    @property
+    def nbytes(self) -> int:
+        return sum(len(stage.bits) for stage in self._stages)
+
+
+def make_index(kind: str = "exact") -> SampleIndex:
+    if kind == "exact":
+        return ExactIndex()
+    if kind == "bloom":
+        return BloomIndex()
+    raise ValueError(f"index kind must be one of {', '.join(INDEX_KINDS)}")
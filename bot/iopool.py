@@ -0,0 +1,65 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from .metrics import STORAGE_IO_LATENCY
+
+
+class ChatIOPool:
+    # Blocking storage calls on a bounded thread pool. Jobs for one chat run
+    # strictly in submission order; different chats run in parallel.
+    def __init__(self, max_workers: int = 4):
+        self.max_workers = max_workers
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="storage-io")
+        self._tails: dict[int, asyncio.Future] = {}
+
+    def __len__(self) -> int:
+        return len(self._tails)
+
+    def submit(self, chat_id: int, func: Callable[..., Any], *args: Any) -> asyncio.Future:
+        # The job is queued behind the chat's previous one at call time, so
+        # callers that must not be overtaken should submit before awaiting.
+        loop = asyncio.get_running_loop()
+        previous = self._tails.get(chat_id)
+        # resolves once the job has run; unlike `result` it is never cancelled
+        done = loop.create_future()
+        self._tails[chat_id] = done
+        result = loop.create_future()
+        queued = time.perf_counter()
+
+        def start(_: Optional[asyncio.Future] = None) -> None:
+            job = loop.run_in_executor(self._pool, func, *args)
+            job.add_done_callback(finish)
+
+        def finish(job: asyncio.Future) -> None:
+            STORAGE_IO_LATENCY.observe(time.perf_counter() - queued, op=func.__name__)
+            done.set_result(None)
+            if self._tails.get(chat_id) is done:
+                del self._tails[chat_id]
+            if result.cancelled():
+                return
+            if job.cancelled():
+                result.cancel()
+            elif job.exception() is not None:
+                result.set_exception(job.exception())
+            else:
+                result.set_result(job.result())
+
+        if previous is None:
+            start()
+        else:
+            previous.add_done_callback(start)
+        return result
+
+    async def run(self, chat_id: int, func: Callable[..., Any], *args: Any) -> Any:
+        return await asyncio.shield(self.submit(chat_id, func, *args))
+
+    async def drain(self) -> None:
+        while self._tails:
+            await asyncio.gather(*self._tails.values())
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=True)
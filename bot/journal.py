@@ -0,0 +1,101 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import logging
+from typing import Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class SampleJournal:
+    def __init__(
+        self,
+        write: Callable[[int, list[str]], None],
+        max_batch: int = 256,
+        flush_interval: float = 1.0,
+        submit: Optional[Callable[[int, list[str]], Awaitable[None]]] = None,
+    ):
+        self.write = write
+        # when set, background and batch-full flushes go through it instead of
+        # calling `write` on the event loop
+        self.submit = submit
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.batches_written = 0
+        self.lines_written = 0
+        self._pending: dict[int, list[str]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+        await self.aflush()
+
+    def append(self, chat_id: int, line: str) -> None:
+        pending = self._pending.setdefault(chat_id, [])
+        pending.append(line)
+        if self._task is None:
+            self.flush_chat(chat_id)
+        elif len(pending) >= self.max_batch:
+            write = self.submit_chat(chat_id)
+            if write is not None:
+                asyncio.ensure_future(write).add_done_callback(self.log_failure)
+
+    def pending_count(self, chat_id: int) -> int:
+        return len(self._pending.get(chat_id, ()))
+
+    def flush(self) -> None:
+        for chat_id in list(self._pending):
+            self.flush_chat(chat_id)
+
+    def flush_chat(self, chat_id: int) -> None:
+        lines = self.take(chat_id)
+        if lines:
+            self.write(chat_id, lines)
+
+    def take(self, chat_id: int) -> list[str]:
+        lines = self._pending.pop(chat_id, None)
+        if not lines:
+            return []
+        self.batches_written += 1
+        self.lines_written += len(lines)
+        return lines
+
+    def submit_chat(self, chat_id: int) -> Optional[Awaitable[None]]:
+        # lines are taken now, so the write is queued ahead of anything the
+        # caller submits for this chat afterwards
+        lines = self.take(chat_id)
+        if not lines:
+            return None
+        if self.submit is None:
+            self.write(chat_id, lines)
+            return None
+        return self.submit(chat_id, lines)
+
+    async def aflush(self) -> None:
+        writes = [self.submit_chat(chat_id) for chat_id in list(self._pending)]
+        results = await asyncio.gather(*filter(None, writes), return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                logger.error("Failed to write journal batch", exc_info=result)
+
+    @staticmethod
+    def log_failure(future: asyncio.Future) -> None:
+        if not future.cancelled() and future.exception() is not None:
+            logger.error("Failed to write journal batch", exc_info=future.exception())
+
+    def discard(self, chat_id: int) -> None:
+        self._pending.pop(chat_id, None)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.aflush()
@@ -4,6 +4,17 @@ from .models import ChatSettings
 from .textgen import size_to_name
 
 
+def retention_label(settings: ChatSettings) -> str:
+    limits = (
+        settings.retention_max_lines,
+        settings.retention_max_kb,
+        settings.retention_max_days,
+    )
+    if not any(limits):
+        return "без лимита"
+    return "{}ф / {}КБ / {}д".format(*(value or "∞" for value in limits))
+
+
 def settings_kb(settings: ChatSettings) -> InlineKeyboardMarkup:
     enabled = "✅ Вкл" if settings.auto_reply_enabled else "❌ Выкл"
     return InlineKeyboardMarkup(
@@ -34,6 +45,16 @@ def settings_kb(settings: ChatSettings) -> InlineKeyboardMarkup:
                     callback_data="set:defsize",
                 ),
             ],
+            [
+                InlineKeyboardButton(
+                    text=f"Порядок цепи: {settings.chain_order}",
+                    callback_data="set:order",
+                ),
+                InlineKeyboardButton(
+                    text=f"Хранение: {retention_label(settings)}",
+                    callback_data="set:retention",
+                ),
+            ],
             [
                 InlineKeyboardButton(text="✨ Генерировать", callback_data="gen:menu"),
                 InlineKeyboardButton(text="🧹 Очистить базу", callback_data="clear:confirm"),
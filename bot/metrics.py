@@ -0,0 +1,187 @@
+from __future__ import annotations
+
+import asyncio
+import bisect
+import logging
+import time
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Any, Callable, Iterator, Optional
+
+if TYPE_CHECKING:
+    from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+TRIES_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 300)
+BYTES_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+Labels = tuple[tuple[str, str], ...]
+
+
+def _labels(labels: dict[str, Any]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format(name: str, labels: Labels, extra: Optional[tuple[str, str]] = None) -> str:
+    pairs = [*labels, extra] if extra else list(labels)
+    if not pairs:
+        return name
+    inner = ",".join(f'{key}="{value}"' for key, value in pairs)
+    return f"{name}{{{inner}}}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self.values: dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        key = _labels(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self) -> Iterator[tuple[str, float]]:
+        for labels, value in self.values.items():
+            yield _format(self.name, labels), value
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels: Any) -> None:
+        self.values[_labels(labels)] = value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, buckets: tuple[float, ...]):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.values: dict[Labels, tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = _labels(labels)
+        entry = self.values.get(key)
+        if entry is None:
+            entry = self.values[key] = ([0] * (len(self.buckets) + 1), [0.0])
+        counts, total = entry
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        total[0] += value
+
+    @contextmanager
+    def time(self, **labels: Any) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self) -> Iterator[tuple[str, float]]:
+        for labels, (counts, total) in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield _format(f"{self.name}_bucket", labels, ("le", str(bound))), cumulative
+            cumulative += counts[-1]
+            yield _format(f"{self.name}_bucket", labels, ("le", "+Inf")), cumulative
+            yield _format(f"{self.name}_sum", labels), total[0]
+            yield _format(f"{self.name}_count", labels), cumulative
+
+
+class Registry:
+    def __init__(self) -> None:
+        self.metrics: list[Any] = []
+        self.collectors: list[Callable[[], None]] = []
+
+    def counter(self, name: str, help_text: str) -> Counter:
+        metric = Counter(name, help_text)
+        self.metrics.append(metric)
+        return metric
+
+    def gauge(self, name: str, help_text: str) -> Gauge:
+        metric = Gauge(name, help_text)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help_text: str, buckets: tuple[float, ...]) -> Histogram:
+        metric = Histogram(name, help_text, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def on_collect(self, collector: Callable[[], None]) -> None:
+        self.collectors.append(collector)
+
+    def render(self) -> str:
+        for collector in self.collectors:
+            collector()
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(f"{name} {value:g}" for name, value in metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HANDLER_LATENCY = REGISTRY.histogram(
+    "witless_handler_seconds", "Handler latency by handler name", LATENCY_BUCKETS
+)
+GENERATE_LATENCY = REGISTRY.histogram(
+    "witless_generate_seconds", "generate() latency by size bucket", LATENCY_BUCKETS
+)
+GENERATE_TRIES = REGISTRY.histogram(
+    "witless_generate_tries", "Walks used per generate() call", TRIES_BUCKETS
+)
+GENERATE_RESULTS = REGISTRY.counter(
+    "witless_generate_total", "generate() calls by outcome (ok, empty, dropped, coalesced)"
+)
+DISK_READ_BYTES = REGISTRY.histogram(
+    "witless_disk_read_bytes", "Bytes of samples read per storage call", BYTES_BUCKETS
+)
+DISK_WRITE_BYTES = REGISTRY.histogram(
+    "witless_disk_write_bytes", "Bytes of samples written per journal batch", BYTES_BUCKETS
+)
+STORAGE_IO_LATENCY = REGISTRY.histogram(
+    "witless_storage_io_seconds", "Storage I/O job latency (queued to done) by op", LATENCY_BUCKETS
+)
+MESSAGES_STORED = REGISTRY.counter("witless_messages_stored_total", "Samples appended")
+AUTO_REPLIES = REGISTRY.counter("witless_auto_replies_total", "Auto-replies sent")
+SEND_RESULTS = REGISTRY.counter(
+    "witless_send_total", "Outbound replies by outcome and priority"
+)
+SEND_QUEUE_DEPTH = REGISTRY.gauge("witless_send_queue_depth", "Replies waiting in the send queue")
+REPLY_POOL_RESULTS = REGISTRY.counter(
+    "witless_reply_pool_total", "Reply pool lookups by outcome (hit, miss, stale)"
+)
+REPLY_POOL_REFILLS = REGISTRY.counter(
+    "witless_reply_pool_refills_total", "Background reply pool refills by outcome"
+)
+ACTIVE_CHATS = REGISTRY.gauge("witless_active_chats", "Chats with in-memory state")
+CACHE_HITS = REGISTRY.counter("witless_cache_hits_total", "ChatStorage cache hits by cache")
+CACHE_MISSES = REGISTRY.counter("witless_cache_misses_total", "ChatStorage cache misses by cache")
+
+
+async def start_metrics_server(host: str, port: int) -> "web.AppRunner":
+    from aiohttp import web
+
+    async def handle_metrics(_: web.Request) -> web.Response:
+        return web.Response(text=REGISTRY.render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+async def log_metrics(interval: float) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        logger.info("metrics:\n%s", REGISTRY.render())
@@ -0,0 +1,66 @@
+from __future__ import annotations
+
+import argparse
+from pathlib import Path
+from typing import Optional
+
+from .backends import FileBackend
+from .config import AppConfig
+from .retention import SampleRecord
+from .sqlite_backend import SqliteBackend
+
+
+def migrate_files_to_sqlite(
+    source: FileBackend,
+    target: SqliteBackend,
+    batch_size: int = 10000,
+) -> tuple[int, int]:
+    chats = 0
+    samples = 0
+    for path in sorted(source.dialogs_dir.glob("*.txt")):
+        try:
+            chat_id = int(path.stem)
+        except ValueError:
+            continue
+
+        target.ensure_chat(chat_id)
+        target.clear_samples(chat_id)
+        # records keep their weight and timestamp, so retention sees the real age
+        batch: list[SampleRecord] = []
+        for record in source.iter_records(chat_id):
+            batch.append(record)
+            if len(batch) >= batch_size:
+                target.append_records(chat_id, batch)
+                samples += sum(weight for _, weight, _ in batch)
+                batch = []
+        if batch:
+            target.append_records(chat_id, batch)
+            samples += sum(weight for _, weight, _ in batch)
+        chats += 1
+
+    for chat_id, data in source.iter_settings():
+        target.save_settings(chat_id, data)
+
+    return chats, samples
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    config = AppConfig.from_env()
+    parser = argparse.ArgumentParser(description="Import Dialogs/ text files into SQLite")
+    parser.add_argument("--dialogs-dir", type=Path, default=config.dialogs_dir)
+    parser.add_argument("--settings-dir", type=Path, default=config.settings_dir)
+    parser.add_argument("--sqlite-path", type=Path, default=config.sqlite_path)
+    args = parser.parse_args(argv)
+
+    source = FileBackend(args.dialogs_dir, args.settings_dir)
+    target = SqliteBackend(args.sqlite_path)
+    try:
+        chats, samples = migrate_files_to_sqlite(source, target)
+    finally:
+        source.close()
+        target.close()
+    print(f"imported {samples} samples from {chats} chats into {args.sqlite_path}")
+
+
+if __name__ == "__main__":
+    main()
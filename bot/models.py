@@ -8,3 +8,7 @@ class ChatSettings:
     max_store_text_len: int = 80
     min_samples: int = 4
     default_gen_size: int = 0
+    chain_order: int = 1
+    retention_max_lines: int = 0
+    retention_max_kb: int = 0
+    retention_max_days: int = 0
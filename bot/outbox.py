@@ -0,0 +1,284 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import itertools
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Optional
+
+from aiogram.exceptions import TelegramRetryAfter
+
+from .cache import LRUCache
+from .metrics import SEND_QUEUE_DEPTH, SEND_RESULTS
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_COMMAND = 0
+PRIORITY_AUTO_REPLY = 1
+
+Produce = Callable[[], Awaitable[Optional[str]]]
+Deliver = Callable[[str], Awaitable[Any]]
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self, now: float) -> None:
+        self._refill(now)
+        self.tokens -= 1
+
+    def block(self, now: float, seconds: float) -> None:
+        self._refill(now)
+        self.tokens = min(self.tokens, 1 - seconds * self.rate)
+
+
+@dataclass
+class _Job:
+    chat_id: int
+    priority: int
+    seq: int
+    produce: Produce
+    deliver: Deliver
+    deadline: Optional[float]
+    future: asyncio.Future
+    text: Optional[str] = None
+    attempts: int = 0
+
+    def expired(self, now: float) -> bool:
+        return self.deadline is not None and now > self.deadline
+
+
+class SendScheduler:
+    def __init__(
+        self,
+        global_rate: float = 30.0,
+        global_burst: float = 30.0,
+        chat_rate: float = 1 / 3,
+        chat_burst: float = 3.0,
+        max_queue: int = 1000,
+        auto_reply_ttl: float = 15.0,
+        max_retries: int = 3,
+        max_inflight: int = 16,
+    ):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_queue = max_queue
+        self.auto_reply_ttl = auto_reply_ttl
+        self.max_retries = max_retries
+        self._global = TokenBucket(global_rate, global_burst)
+        self._buckets: LRUCache[int, TokenBucket] = LRUCache(max(1024, max_queue * 4))
+        self._queues: dict[int, deque[_Job]] = {}
+        self._size = 0
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._slots = asyncio.Semaphore(max_inflight)
+        self._tasks: set[asyncio.Task] = set()
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return self._size
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        for jobs in self._queues.values():
+            for job in jobs:
+                self._finish(job, False, "dropped")
+        self._queues.clear()
+        self._size = 0
+
+    def submit(
+        self,
+        chat_id: int,
+        priority: int,
+        produce: Produce,
+        deliver: Deliver,
+    ) -> asyncio.Future:
+        now = time.monotonic()
+        deadline = now + self.auto_reply_ttl if priority >= PRIORITY_AUTO_REPLY else None
+        job = _Job(
+            chat_id,
+            priority,
+            next(self._seq),
+            produce,
+            deliver,
+            deadline,
+            asyncio.get_running_loop().create_future(),
+        )
+        if self._size >= self.max_queue:
+            self._prune(now)
+        if self._size >= self.max_queue and not self._evict_for(job):
+            self._finish(job, False, "dropped")
+            return job.future
+
+        jobs = self._queues.setdefault(chat_id, deque())
+        position = len(jobs)
+        while position and jobs[position - 1].priority > priority:
+            position -= 1
+        jobs.insert(position, job)
+        self._size += 1
+        SEND_QUEUE_DEPTH.set(self._size)
+        self._wakeup.set()
+        return job.future
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._buckets.put(chat_id, bucket)
+        return bucket
+
+    def _prune(self, now: float) -> None:
+        for chat_id in list(self._queues):
+            jobs = self._queues[chat_id]
+            kept = deque(job for job in jobs if not job.expired(now))
+            for job in jobs:
+                if job.expired(now):
+                    self._finish(job, False, "expired")
+            self._size -= len(jobs) - len(kept)
+            if kept:
+                self._queues[chat_id] = kept
+            else:
+                del self._queues[chat_id]
+        SEND_QUEUE_DEPTH.set(self._size)
+
+    def _evict_for(self, job: _Job) -> bool:
+        victim: Optional[_Job] = None
+        for jobs in self._queues.values():
+            for queued in jobs:
+                if victim is None or (queued.priority, queued.seq) > (victim.priority, victim.seq):
+                    victim = queued
+        if victim is None or victim.priority <= job.priority:
+            return False
+        self._remove(victim)
+        self._finish(victim, False, "dropped")
+        return True
+
+    def _remove(self, job: _Job) -> None:
+        jobs = self._queues[job.chat_id]
+        jobs.remove(job)
+        if not jobs:
+            del self._queues[job.chat_id]
+        self._size -= 1
+        SEND_QUEUE_DEPTH.set(self._size)
+
+    def _pick(self, now: float) -> tuple[Optional[_Job], float]:
+        best: Optional[_Job] = None
+        wait = float("inf")
+        for chat_id in list(self._queues):
+            jobs = self._queues[chat_id]
+            while jobs and jobs[0].expired(now):
+                self._finish(jobs.popleft(), False, "expired")
+                self._size -= 1
+            if not jobs:
+                del self._queues[chat_id]
+                continue
+            delay = self._chat_bucket(chat_id).delay(now)
+            if delay > 0:
+                wait = min(wait, delay)
+                continue
+            head = jobs[0]
+            if best is None or (head.priority, head.seq) < (best.priority, best.seq):
+                best = head
+        SEND_QUEUE_DEPTH.set(self._size)
+        return best, wait
+
+    async def _run(self) -> None:
+        while True:
+            await self._slots.acquire()
+            try:
+                job = await self._next_job()
+            except BaseException:
+                self._slots.release()
+                raise
+            self._remove(job)
+            now = time.monotonic()
+            self._global.consume(now)
+            self._chat_bucket(job.chat_id).consume(now)
+            task = asyncio.create_task(self._send(job))
+            self._tasks.add(task)
+            task.add_done_callback(self._release)
+
+    async def _next_job(self) -> _Job:
+        while True:
+            if not self._size:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            now = time.monotonic()
+            delay = self._global.delay(now)
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+
+            job, wait = self._pick(now)
+            if job is not None:
+                return job
+            if self._size:
+                self._wakeup.clear()
+                with contextlib.suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+
+    def _release(self, task: asyncio.Task) -> None:
+        self._tasks.discard(task)
+        self._slots.release()
+
+    async def _send(self, job: _Job) -> None:
+        try:
+            if job.text is None:
+                job.text = await job.produce()
+            if job.text is None:
+                self._finish(job, False, "empty")
+                return
+            job.attempts += 1
+            await job.deliver(job.text)
+        except TelegramRetryAfter as exc:
+            now = time.monotonic()
+            self._chat_bucket(job.chat_id).block(now, exc.retry_after)
+            if job.attempts > self.max_retries or job.expired(now + exc.retry_after):
+                self._finish(job, False, "failed")
+                return
+            SEND_RESULTS.inc(outcome="retried", priority=job.priority)
+            self._queues.setdefault(job.chat_id, deque()).appendleft(job)
+            self._size += 1
+            SEND_QUEUE_DEPTH.set(self._size)
+            self._wakeup.set()
+        except Exception:
+            logger.exception("Failed to send to chat %s", job.chat_id)
+            self._finish(job, False, "failed")
+        else:
+            self._finish(job, True, "sent")
+
+    def _finish(self, job: _Job, sent: bool, outcome: str) -> None:
+        SEND_RESULTS.inc(outcome=outcome, priority=job.priority)
+        if not job.future.done():
+            job.future.set_result(sent)
@@ -0,0 +1,122 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+from typing import TYPE_CHECKING, Any, Optional
+
+from aiogram.fsm.storage.base import BaseStorage
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from .config import AppConfig
+
+if TYPE_CHECKING:
+    from redis.asyncio import Redis
+
+logger = logging.getLogger(__name__)
+
+FSM_STORAGES = ("memory", "redis")
+SETTINGS_CACHES = ("memory", "redis")
+
+
+def _redis_client(url: str) -> "Redis":
+    try:
+        from redis.asyncio import Redis
+    except ImportError as exc:
+        raise RuntimeError("the redis package is required for Redis storage") from exc
+    return Redis.from_url(url)
+
+
+def _redis_fsm_storage(config: AppConfig) -> BaseStorage:
+    # aiogram's redis storage module imports redis itself, so it stays behind the guard
+    try:
+        from aiogram.fsm.storage.redis import DefaultKeyBuilder, RedisStorage
+    except ImportError as exc:
+        raise RuntimeError("the redis package is required for Redis storage") from exc
+    return RedisStorage(
+        _redis_client(config.redis_url),
+        key_builder=DefaultKeyBuilder(prefix=f"{config.redis_prefix}:fsm"),
+        state_ttl=config.redis_fsm_ttl or None,
+        data_ttl=config.redis_fsm_ttl or None,
+    )
+
+
+def open_fsm_storage(config: AppConfig) -> BaseStorage:
+    if config.fsm_storage == "memory":
+        return MemoryStorage()
+    if config.fsm_storage == "redis":
+        return _redis_fsm_storage(config)
+    raise ValueError(f"unknown FSM storage: {config.fsm_storage}")
+
+
+def open_settings_cache(config: AppConfig) -> Optional["SharedSettingsCache"]:
+    if config.settings_cache == "memory":
+        return None
+    if config.settings_cache == "redis":
+        return SharedSettingsCache(
+            _redis_client(config.redis_url),
+            prefix=f"{config.redis_prefix}:settings:",
+            ttl=config.redis_settings_ttl,
+        )
+    raise ValueError(f"unknown settings cache: {config.settings_cache}")
+
+
+class SharedSettingsCache:
+    def __init__(self, client: "Redis", prefix: str = "witless:settings:", ttl: int = 3600):
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+        self.round_trips = 0
+        self._pending: dict[int, list[asyncio.Future]] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def _key(self, chat_id: int) -> str:
+        return f"{self.prefix}{chat_id}"
+
+    async def get(self, chat_id: int) -> Optional[dict[str, Any]]:
+        future = asyncio.get_running_loop().create_future()
+        self._pending.setdefault(chat_id, []).append(future)
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush())
+        return await future
+
+    async def set(self, chat_id: int, data: dict[str, Any]) -> None:
+        try:
+            await self.client.set(self._key(chat_id), json.dumps(data), ex=self.ttl or None)
+        except Exception:
+            logger.warning("Failed to cache settings for chat %s", chat_id, exc_info=True)
+
+    async def delete(self, chat_id: int) -> None:
+        try:
+            await self.client.delete(self._key(chat_id))
+        except Exception:
+            logger.warning("Failed to drop cached settings for chat %s", chat_id, exc_info=True)
+
+    async def close(self) -> None:
+        if self._flush_task is not None:
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+        await self.client.aclose()
+
+    async def _flush(self) -> None:
+        await asyncio.sleep(0)
+        pending, self._pending = self._pending, {}
+        self._flush_task = None
+        chat_ids = list(pending)
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            for chat_id in chat_ids:
+                pipe.get(self._key(chat_id))
+            raw_values = await pipe.execute()
+            self.round_trips += 1
+        except Exception:
+            logger.warning("Shared settings cache is unavailable", exc_info=True)
+            raw_values = [None] * len(chat_ids)
+
+        for chat_id, raw in zip(chat_ids, raw_values):
+            try:
+                value = json.loads(raw) if raw is not None else None
+            except ValueError:
+                value = None
+            for future in pending[chat_id]:
+                if not future.done():
+                    future.set_result(value)
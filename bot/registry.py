@@ -0,0 +1,51 @@
+from __future__ import annotations
+
+import time
+from collections import OrderedDict
+from typing import Optional
+
+
+class ChatRegistry:
+    def __init__(self, idle_ttl: float = 3600.0):
+        self.idle_ttl = idle_ttl
+        self.activations = 0
+        self.evictions = 0
+        self._last_seen: OrderedDict[int, float] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._last_seen)
+
+    def __contains__(self, chat_id: int) -> bool:
+        return chat_id in self._last_seen
+
+    def touch(self, chat_id: int, now: Optional[float] = None) -> bool:
+        now = time.monotonic() if now is None else now
+        activated = chat_id not in self._last_seen
+        if activated:
+            self.activations += 1
+        else:
+            self._last_seen.move_to_end(chat_id)
+        self._last_seen[chat_id] = now
+        return activated
+
+    def expired(self, now: Optional[float] = None) -> list[int]:
+        if self.idle_ttl <= 0:
+            return []
+        cutoff = (time.monotonic() if now is None else now) - self.idle_ttl
+        chat_ids = []
+        for chat_id, last_seen in self._last_seen.items():
+            if last_seen > cutoff:
+                break
+            chat_ids.append(chat_id)
+        return chat_ids
+
+    def forget(self, chat_id: int) -> None:
+        if self._last_seen.pop(chat_id, None) is not None:
+            self.evictions += 1
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "active": len(self._last_seen),
+            "activations": self.activations,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,171 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import logging
+import time
+from collections import deque
+from typing import Optional
+
+from .cache import LRUCache
+from .chain import ChainModel
+from .executor import GenerationExecutor
+from .metrics import REPLY_POOL_REFILLS, REPLY_POOL_RESULTS
+from .outbox import TokenBucket
+from .storage import ChatStorage
+
+logger = logging.getLogger(__name__)
+
+PoolKey = tuple[int, int]
+
+
+class _Pool:
+    __slots__ = ("uid", "replies")
+
+    def __init__(self, uid: int):
+        self.uid = uid
+        # text, model version it was generated at, monotonic creation time
+        self.replies: deque[tuple[str, int, float]] = deque()
+
+
+class ReplyPool:
+    def __init__(
+        self,
+        storage: ChatStorage,
+        generator: GenerationExecutor,
+        pool_size: int = 4,
+        max_chats: int = 256,
+        refill_rate: float = 5.0,
+        max_age: float = 600.0,
+        max_stale: int = 50,
+        idle_after: float = 300.0,
+        tries_count: int = 200,
+        busy_backoff: float = 0.05,
+    ):
+        self.storage = storage
+        self.generator = generator
+        self.pool_size = pool_size
+        self.max_age = max_age
+        self.max_stale = max_stale
+        self.idle_after = idle_after
+        self.tries_count = tries_count
+        self.busy_backoff = busy_backoff
+        self._pools: LRUCache[PoolKey, _Pool] = LRUCache(max_chats * 4)
+        self._wanted: dict[PoolKey, tuple[int, float]] = {}
+        self._bucket = TokenBucket(refill_rate, max(1.0, refill_rate))
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.pool_size > 0
+
+    def start(self) -> None:
+        if self.enabled and self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+        self._pools.clear()
+        self._wanted.clear()
+
+    def take(self, chat_id: int, model: ChainModel, size: int) -> Optional[str]:
+        if not self.enabled:
+            return None
+        key = (chat_id, size)
+        self._wanted[key] = (model.order, time.monotonic())
+        self._wakeup.set()
+
+        pool = self._pools.get(key)
+        if pool is None or pool.uid != model.uid:
+            REPLY_POOL_RESULTS.inc(outcome="miss")
+            return None
+        self._expire(pool, model)
+        while pool.replies:
+            text = pool.replies.popleft()[0]
+            if model.is_known(text):
+                REPLY_POOL_RESULTS.inc(outcome="stale")
+                continue
+            REPLY_POOL_RESULTS.inc(outcome="hit")
+            return text
+        REPLY_POOL_RESULTS.inc(outcome="miss")
+        return None
+
+    def _expire(self, pool: _Pool, model: ChainModel) -> None:
+        now = time.monotonic()
+        replies = pool.replies
+        while replies and (
+            model.version - replies[0][1] > self.max_stale or now - replies[0][2] > self.max_age
+        ):
+            replies.popleft()
+            REPLY_POOL_RESULTS.inc(outcome="stale")
+
+    def _next_wanted(self, now: float) -> Optional[PoolKey]:
+        for key in list(self._wanted):
+            order, last_demand = self._wanted.pop(key)
+            if now - last_demand > self.idle_after:
+                self._pools.pop(key)
+                continue
+            pool = self._pools.peek(key)
+            if pool is not None and len(pool.replies) >= self.pool_size:
+                continue
+            self._wanted[key] = (order, last_demand)
+            return key
+        return None
+
+    async def _run(self) -> None:
+        while True:
+            if not self._wanted:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            now = time.monotonic()
+            delay = self._bucket.delay(now)
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            if not self.generator.idle:
+                await asyncio.sleep(self.busy_backoff)
+                continue
+
+            key = self._next_wanted(now)
+            if key is None:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            self._bucket.consume(now)
+            try:
+                await self._refill(key)
+            except Exception:
+                logger.exception("Failed to refill reply pool for chat %s", key[0])
+                REPLY_POOL_REFILLS.inc(outcome="failed")
+
+    async def _refill(self, key: PoolKey) -> None:
+        chat_id, size = key
+        order = self._wanted[key][0]
+        model = await self.storage.achain(chat_id, order)
+        if not model.sample_count:
+            self._wanted.pop(key, None)
+            return
+
+        version = model.version
+        pool = self._pools.peek(key)
+        missing = self.pool_size - (len(pool.replies) if pool is not None else 0)
+        found = await self.generator.prefill(chat_id, model, missing, self.tries_count, size)
+        if not found:
+            REPLY_POOL_REFILLS.inc(outcome="empty")
+            return
+
+        pool = self._pools.peek(key)
+        if pool is None or pool.uid != model.uid:
+            pool = _Pool(model.uid)
+            self._pools.put(key, pool)
+        created = time.monotonic()
+        for text in found[: self.pool_size - len(pool.replies)]:
+            pool.replies.append((text, version, created))
+        REPLY_POOL_REFILLS.inc(outcome="ok")
@@ -0,0 +1,73 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Iterable
+
+from .models import ChatSettings
+
+# text, weight, unix timestamp (0 when unknown)
+SampleRecord = tuple[str, int, int]
+
+
+@dataclass(frozen=True)
+class RetentionPolicy:
+    max_lines: int = 0
+    max_bytes: int = 0
+    max_age: int = 0
+
+    @classmethod
+    def from_settings(cls, settings: ChatSettings) -> "RetentionPolicy":
+        return cls(
+            max_lines=settings.retention_max_lines,
+            max_bytes=settings.retention_max_kb * 1024,
+            max_age=settings.retention_max_days * 86400,
+        )
+
+
+def record_size(text: str) -> int:
+    return len(text.encode("utf8")) + 1
+
+
+def compact_records(
+    records: Iterable[SampleRecord],
+    policy: RetentionPolicy,
+    now: int,
+) -> tuple[list[SampleRecord], int]:
+    cutoff = now - policy.max_age if policy.max_age > 0 else None
+    dropped = 0
+    merged: dict[str, tuple[int, int]] = {}
+    for text, weight, timestamp in records:
+        timestamp = timestamp or now
+        if cutoff is not None and timestamp < cutoff:
+            dropped += weight
+            continue
+        previous = merged.pop(text, None)
+        if previous is not None:
+            weight += previous[0]
+            timestamp = max(timestamp, previous[1])
+        merged[text] = (weight, timestamp)
+
+    result = [(text, weight, timestamp) for text, (weight, timestamp) in merged.items()]
+    start = 0
+
+    if policy.max_lines > 0:
+        excess = sum(weight for _, weight, _ in result) - policy.max_lines
+        while excess > 0:
+            text, weight, timestamp = result[start]
+            if weight > excess:
+                result[start] = (text, weight - excess, timestamp)
+                dropped += excess
+                break
+            dropped += weight
+            excess -= weight
+            start += 1
+
+    if policy.max_bytes > 0:
+        excess = sum(record_size(text) for text, _, _ in result[start:]) - policy.max_bytes
+        while excess > 0 and start < len(result):
+            text, weight, _ = result[start]
+            excess -= record_size(text)
+            dropped += weight
+            start += 1
+
+    return result[start:], dropped
@@ -0,0 +1,238 @@
+from __future__ import annotations
+
+import contextlib
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Any, Iterator, Optional
+
+from .snapshot import write_atomic
+
+try:
+    import fcntl
+except ImportError:  # POSIX only; without it shard workers must not share the file
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+
+
+def encode_settings(chats: dict[int, dict[str, Any]]) -> bytes:
+    # field names are stored once; records with a different key set keep their dict
+    fields = list(dict.fromkeys(key for data in chats.values() for key in data))
+    records: dict[str, Any] = {}
+    for chat_id, data in sorted(chats.items()):
+        aligned = data.keys() == set(fields)
+        records[str(chat_id)] = [data[key] for key in fields] if aligned else data
+    payload = {"version": FORMAT_VERSION, "fields": fields, "chats": records}
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf8")
+
+
+def decode_settings(raw: bytes) -> dict[int, dict[str, Any]]:
+    payload = json.loads(raw)
+    if payload.get("version") != FORMAT_VERSION:
+        raise ValueError(f"unsupported settings format {payload.get('version')!r}")
+    fields = payload["fields"]
+    return {
+        int(chat_id): dict(zip(fields, values)) if isinstance(values, list) else dict(values)
+        for chat_id, values in payload["chats"].items()
+    }
+
+
+class SettingsStore:
+    # Settings of every chat in one file indexed by chat id. Changes are kept in
+    # memory and written atomically at most once per `flush_delay`. A flush merges
+    # this process's changed chats into the current file and a read picks up
+    # writes by other processes, so shard workers can share the file.
+    def __init__(self, path: Path, legacy_dir: Optional[Path] = None, flush_delay: float = 0.5):
+        self.path = path
+        self.legacy_dir = legacy_dir
+        self.flush_delay = flush_delay
+        self.writes = 0
+        self._chats: Optional[dict[int, dict[str, Any]]] = None
+        self._stamp: Optional[tuple[int, int, int]] = None
+        self._dirty: set[int] = set()
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._timer: Optional[threading.Timer] = None
+
+    def get(self, chat_id: int) -> Optional[dict[str, Any]]:
+        with self._lock:
+            data = self._current().get(chat_id)
+        return dict(data) if data is not None else None
+
+    def put(self, chat_id: int, data: dict[str, Any]) -> None:
+        with self._lock:
+            self._load()[chat_id] = dict(data)
+            self._dirty.add(chat_id)
+            if self.flush_delay > 0:
+                self._schedule()
+                return
+        self.flush()
+
+    def items(self) -> Iterator[tuple[int, dict[str, Any]]]:
+        with self._lock:
+            chats = sorted(self._current().items())
+        for chat_id, data in chats:
+            yield chat_id, dict(data)
+
+    def flush(self) -> None:
+        # rewrites the whole file, O(all chats), at most once per flush_delay
+        with self._write_lock:
+            with self._lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                if self._chats is None or not self._dirty:
+                    return
+                changes = {chat_id: self._chats[chat_id] for chat_id in self._dirty}
+                self._dirty.clear()
+                known = dict(self._chats)
+            try:
+                with self._file_lock():
+                    chats = self._merge_base(known)
+                    chats.update(changes)
+                    write_atomic(self.path, encode_settings(chats))
+                    stamp = self._stat()
+            except Exception:
+                with self._lock:
+                    self._dirty.update(changes)
+                raise
+            with self._lock:
+                # keep what was saved while the file was being written
+                for chat_id in self._dirty:
+                    chats[chat_id] = self._chats[chat_id]
+                self._chats = chats
+                self._stamp = stamp
+            self.writes += 1
+
+    def close(self) -> None:
+        self.flush()
+
+    def _schedule(self) -> None:
+        if self._timer is None:
+            self._timer = threading.Timer(self.flush_delay, self._flush_later)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _flush_later(self) -> None:
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Failed to write settings to %s", self.path)
+
+    def _load(self) -> dict[int, dict[str, Any]]:
+        if self._chats is None:
+            stamp = self._stat()
+            try:
+                chats = self._read()
+            except ValueError:
+                with self._file_lock():
+                    chats = self._recover()
+                    stamp = self._stat()
+            if chats is None:
+                chats = self._import_legacy()
+                self._dirty.update(chats)
+                if chats:
+                    self._schedule()
+            self._chats = chats
+            self._stamp = stamp
+        return self._chats
+
+    def _current(self) -> dict[int, dict[str, Any]]:
+        chats = self._load()
+        stamp = self._stat()
+        if stamp is None or stamp == self._stamp:
+            return chats
+        try:
+            loaded = self._read()
+        except ValueError:
+            logger.error("Unreadable settings store %s, keeping the loaded copy", self.path)
+            return chats
+        if loaded is None:
+            return chats
+        for chat_id in self._dirty:
+            loaded[chat_id] = chats[chat_id]
+        self._chats = loaded
+        self._stamp = stamp
+        return loaded
+
+    def _merge_base(self, known: dict[int, dict[str, Any]]) -> dict[int, dict[str, Any]]:
+        try:
+            chats = self._read()
+        except ValueError:
+            corrupt = self._set_aside()
+            logger.error(
+                "Unreadable settings store %s, moved it to %s and rewrote it from memory",
+                self.path,
+                corrupt,
+            )
+            return known
+        return known if chats is None else chats
+
+    def _recover(self) -> Optional[dict[int, dict[str, Any]]]:
+        # another worker may have rewritten the file since it failed to parse
+        try:
+            return self._read()
+        except ValueError:
+            corrupt = self._set_aside()
+        logger.error(
+            "Unreadable settings store %s, moved it to %s and started without it",
+            self.path,
+            corrupt,
+        )
+        return None
+
+    def _set_aside(self) -> Path:
+        corrupt = self.path.with_suffix(self.path.suffix + ".corrupt")
+        os.replace(self.path, corrupt)
+        return corrupt
+
+    def _read(self) -> Optional[dict[int, dict[str, Any]]]:
+        try:
+            raw = self.path.read_bytes()
+        except FileNotFoundError:
+            return None
+        try:
+            return decode_settings(raw)
+        except Exception as exc:
+            raise ValueError(str(exc)) from exc
+
+    def _stat(self) -> Optional[tuple[int, int, int]]:
+        try:
+            stat = self.path.stat()
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _import_legacy(self) -> dict[int, dict[str, Any]]:
+        # one JSON file per chat, as written before the store existed
+        chats: dict[int, dict[str, Any]] = {}
+        if self.legacy_dir is None or not self.legacy_dir.is_dir():
+            return chats
+        for path in self.legacy_dir.glob("*.json"):
+            try:
+                chat_id = int(path.stem)
+            except ValueError:
+                continue
+            try:
+                chats[chat_id] = json.loads(path.read_text(encoding="utf8"))
+            except Exception:
+                logger.warning("Skipping unreadable settings file %s", path)
+        return chats
+
+    @contextlib.contextmanager
+    def _file_lock(self) -> Iterator[None]:
+        if fcntl is None:
+            yield
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path.with_suffix(self.path.suffix + ".lock"), "a") as lock:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
@@ -0,0 +1,205 @@
+from __future__ import annotations
+
+import asyncio
+import bisect
+import contextlib
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import signal
+from dataclasses import replace
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware, Bot, Dispatcher
+from aiogram.types import TelegramObject, Update
+
+from .config import AppConfig
+
+logger = logging.getLogger(__name__)
+
+_CHAT_EVENTS = (
+    "message",
+    "edited_message",
+    "channel_post",
+    "edited_channel_post",
+    "my_chat_member",
+    "chat_member",
+    "chat_join_request",
+)
+_USER_EVENTS = ("inline_query", "chosen_inline_result", "shipping_query", "pre_checkout_query")
+_MAX_LINE = 4 * 1024 * 1024
+
+
+def _point(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    def __init__(self, nodes: int, replicas: int = 128):
+        points = sorted(
+            (_point(f"{node}:{replica}"), node)
+            for node in range(nodes)
+            for replica in range(replicas)
+        )
+        self._points = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def node_for(self, chat_id: int) -> int:
+        index = bisect.bisect_right(self._points, _point(str(chat_id)))
+        return self._nodes[index % len(self._nodes)]
+
+
+def update_chat_id(update: dict) -> int:
+    for event in _CHAT_EVENTS:
+        payload = update.get(event)
+        if payload:
+            return payload["chat"]["id"]
+    query = update.get("callback_query")
+    if query:
+        message = query.get("message")
+        if message:
+            return message["chat"]["id"]
+        return query["from"]["id"]
+    for event in _USER_EVENTS:
+        payload = update.get(event)
+        if payload:
+            return payload["from"]["id"]
+    return 0
+
+
+def update_payload(update: TelegramObject) -> dict:
+    # Bot API field names ("from", not "from_user"), as update_chat_id and the
+    # workers' Update.model_validate expect
+    return update.model_dump(mode="json", exclude_unset=True, by_alias=True)
+
+
+def socket_path(config: AppConfig, worker: int) -> Path:
+    return config.shard_socket_dir / f"worker-{worker}.sock"
+
+
+class ShardForwarder(BaseMiddleware):
+    def __init__(self, writers: list[asyncio.StreamWriter]):
+        self.writers = writers
+        self.ring = HashRing(len(writers))
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        payload = update_payload(event)
+        writer = self.writers[self.ring.node_for(update_chat_id(payload))]
+        writer.write(json.dumps(payload, ensure_ascii=False).encode() + b"\n")
+        await writer.drain()
+        return None
+
+
+async def _connect(path: Path, timeout: float) -> asyncio.StreamWriter:
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while True:
+        try:
+            _, writer = await asyncio.open_unix_connection(str(path))
+            return writer
+        except (FileNotFoundError, ConnectionRefusedError):
+            if loop.time() >= deadline:
+                raise
+            await asyncio.sleep(0.1)
+
+
+async def run_front(
+    config: AppConfig,
+    intake: Callable[[Dispatcher, Bot, AppConfig], Awaitable[None]],
+) -> None:
+    config.shard_socket_dir.mkdir(parents=True, exist_ok=True)
+    for worker in range(config.workers):
+        with contextlib.suppress(FileNotFoundError):
+            socket_path(config, worker).unlink()
+
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(target=worker_main, args=(config, worker), name=f"witless-worker-{worker}")
+        for worker in range(config.workers)
+    ]
+    for process in processes:
+        process.start()
+
+    writers: list[asyncio.StreamWriter] = []
+    try:
+        for worker in range(config.workers):
+            writers.append(await _connect(socket_path(config, worker), config.shard_start_timeout))
+
+        bot = Bot(token=config.token)
+        dispatcher = Dispatcher()
+        dispatcher.update.outer_middleware(ShardForwarder(writers))
+        await intake(dispatcher, bot, config)
+    finally:
+        for writer in writers:
+            writer.close()
+            with contextlib.suppress(Exception):
+                await writer.wait_closed()
+        for process in processes:
+            await asyncio.to_thread(process.join, config.shard_stop_timeout)
+            if process.is_alive():
+                logger.warning("Worker %s did not stop in time, terminating", process.name)
+                process.terminate()
+
+
+def worker_main(config: AppConfig, worker: int) -> None:
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logging.basicConfig(
+        level=logging.INFO,
+        format=f"%(asctime)s [worker {worker}] %(levelname)s %(name)s: %(message)s",
+    )
+    if config.metrics_port > 0:
+        config = replace(config, metrics_port=config.metrics_port + worker + 1)
+
+    from .app import run_dispatcher
+
+    async def intake(dispatcher: Dispatcher, bot: Bot, _: AppConfig) -> None:
+        await serve_shard(dispatcher, bot, socket_path(config, worker))
+
+    asyncio.run(run_dispatcher(config, intake))
+
+
+async def serve_shard(dispatcher: Dispatcher, bot: Bot, path: Path) -> None:
+    tasks: set[asyncio.Task] = set()
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    with contextlib.suppress(NotImplementedError, RuntimeError):
+        loop.add_signal_handler(signal.SIGTERM, stop.set)
+
+    async def process(update: Update) -> None:
+        try:
+            await dispatcher.feed_update(bot, update)
+        except Exception:
+            logger.exception("Failed to process update %s", update.update_id)
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while line := await reader.readline():
+                update = Update.model_validate(json.loads(line), context={"bot": bot})
+                task = asyncio.create_task(process(update))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        finally:
+            writer.close()
+            stop.set()
+
+    server = await asyncio.start_unix_server(handle, path=str(path), limit=_MAX_LINE)
+    try:
+        await dispatcher.emit_startup(bot=bot, dispatcher=dispatcher)
+        await stop.wait()
+    finally:
+        server.close()
+        await server.wait_closed()
+        if tasks:
+            await asyncio.wait(set(tasks))
+        await dispatcher.emit_shutdown(bot=bot, dispatcher=dispatcher)
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(path)
+        await bot.session.close()
@@ -0,0 +1,62 @@
+from __future__ import annotations
+
+import os
+import pickle
+import struct
+import zlib
+from pathlib import Path
+from typing import Optional
+
+from .chain import ChainModel
+
+MAGIC = b"WLCM"
+FORMAT_VERSION = 1
+
+# magic, format version, chain order, dialog offset, payload length, crc32
+_HEADER = struct.Struct("<4sHBQQI")
+
+
+def dump_snapshot(model: ChainModel, offset: int) -> bytes:
+    payload = pickle.dumps(model, protocol=pickle.HIGHEST_PROTOCOL)
+    header = _HEADER.pack(
+        MAGIC, FORMAT_VERSION, model.order, offset, len(payload), zlib.crc32(payload)
+    )
+    return header + payload
+
+
+def write_snapshot(path: Path, data: bytes) -> None:
+    write_atomic(path, data)
+
+
+def write_atomic(path: Path, data: bytes) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    with tmp_path.open("wb") as file:
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, path)
+
+
+def read_snapshot(path: Path, order: int) -> Optional[tuple[ChainModel, int]]:
+    try:
+        data = path.read_bytes()
+    except OSError:
+        return None
+    if len(data) < _HEADER.size:
+        return None
+
+    magic, version, model_order, offset, length, checksum = _HEADER.unpack_from(data)
+    payload = memoryview(data)[_HEADER.size:]
+    if magic != MAGIC or version != FORMAT_VERSION or model_order != order:
+        return None
+    if len(payload) != length or zlib.crc32(payload) != checksum:
+        return None
+
+    try:
+        model = pickle.loads(payload)
+    except Exception:
+        return None
+    if not isinstance(model, ChainModel):
+        return None
+    return model, offset
@@ -0,0 +1,192 @@
+from __future__ import annotations
+
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Iterator, Optional
+
+from .backends import DURABILITY_MODES, expand_records
+from .retention import SampleRecord
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chats (
+    chat_id INTEGER PRIMARY KEY,
+    sample_count INTEGER NOT NULL DEFAULT 0,
+    sample_bytes INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS samples (
+    id INTEGER PRIMARY KEY,
+    chat_id INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    weight INTEGER NOT NULL DEFAULT 1,
+    created_at INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS samples_chat_id ON samples (chat_id, id);
+CREATE TABLE IF NOT EXISTS settings (
+    chat_id INTEGER PRIMARY KEY,
+    data TEXT NOT NULL
+);
+"""
+
+_SYNCHRONOUS = {"none": "OFF", "flush": "NORMAL", "fsync": "FULL"}
+
+_SAMPLE_COLUMNS = {
+    "weight": "INTEGER NOT NULL DEFAULT 1",
+    "created_at": "INTEGER NOT NULL DEFAULT 0",
+}
+
+
+class SqliteBackend:
+    def __init__(self, path: Path, durability: str = "flush"):
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"durability must be one of {', '.join(DURABILITY_MODES)}")
+        self.path = path
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        # one connection is shared by the storage I/O threads; transactions on
+        # it must not interleave
+        self._lock = threading.RLock()
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(f"PRAGMA synchronous={_SYNCHRONOUS[durability]}")
+        self._db.executescript(_SCHEMA)
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(samples)")}
+        for name, definition in _SAMPLE_COLUMNS.items():
+            if name not in columns:
+                self._db.execute(f"ALTER TABLE samples ADD COLUMN {name} {definition}")
+
+    def chat_ids(self) -> list[int]:
+        return [row[0] for row in self._db.execute("SELECT chat_id FROM chats ORDER BY chat_id")]
+
+    def ensure_chat(self, chat_id: int) -> None:
+        self._db.execute("INSERT OR IGNORE INTO chats (chat_id) VALUES (?)", (chat_id,))
+
+    def load_samples(self, chat_id: int) -> list[str]:
+        return list(self.iter_samples(chat_id))
+
+    def iter_samples(self, chat_id: int) -> Iterator[str]:
+        return expand_records(self.iter_records(chat_id))
+
+    def iter_samples_from(self, chat_id: int, offset: int) -> Iterator[str]:
+        rows = self._db.execute(
+            "SELECT text, weight, created_at FROM samples WHERE chat_id = ? AND id > ? ORDER BY id",
+            (chat_id, offset),
+        )
+        return expand_records(rows)
+
+    def iter_weighted(self, chat_id: int) -> Iterator[tuple[str, int]]:
+        rows = self._db.execute(
+            "SELECT text, weight FROM samples WHERE chat_id = ? ORDER BY id", (chat_id,)
+        )
+        for text, weight in rows:
+            yield text, weight
+
+    def iter_records(self, chat_id: int, end: Optional[int] = None) -> Iterator[SampleRecord]:
+        rows = self._db.execute(
+            "SELECT text, weight, created_at FROM samples "
+            "WHERE chat_id = ? AND id <= ? ORDER BY id",
+            (chat_id, end if end is not None else self.sample_offset(chat_id)),
+        )
+        for text, weight, created_at in rows:
+            yield text, weight, created_at
+
+    def sample_offset(self, chat_id: int) -> int:
+        row = self._db.execute(
+            "SELECT max(id) FROM samples WHERE chat_id = ?", (chat_id,)
+        ).fetchone()
+        return row[0] or 0
+
+    def append_samples(self, chat_id: int, lines: list[str]) -> None:
+        created_at = int(time.time())
+        self.append_records(chat_id, [(line, 1, created_at) for line in lines])
+
+    def append_records(self, chat_id: int, records: list[SampleRecord]) -> None:
+        count = sum(weight for _, weight, _ in records)
+        size = sum(len(text.encode("utf8")) + 1 for text, _, _ in records)
+        with self._lock, self._db:
+            self._db.execute("BEGIN")
+            self._db.executemany(
+                "INSERT INTO samples (chat_id, text, weight, created_at) VALUES (?, ?, ?, ?)",
+                [(chat_id, text, weight, created_at) for text, weight, created_at in records],
+            )
+            self._db.execute(
+                "INSERT INTO chats (chat_id, sample_count, sample_bytes) VALUES (?, ?, ?) "
+                "ON CONFLICT (chat_id) DO UPDATE SET "
+                "sample_count = sample_count + excluded.sample_count, "
+                "sample_bytes = sample_bytes + excluded.sample_bytes",
+                (chat_id, count, size),
+            )
+
+    def clear_samples(self, chat_id: int) -> None:
+        with self._lock, self._db:
+            self._db.execute("BEGIN")
+            self._db.execute("DELETE FROM samples WHERE chat_id = ?", (chat_id,))
+            self._db.execute(
+                "UPDATE chats SET sample_count = 0, sample_bytes = 0 WHERE chat_id = ?",
+                (chat_id,),
+            )
+
+    def count_samples(self, chat_id: int) -> int:
+        row = self._db.execute(
+            "SELECT sample_count FROM chats WHERE chat_id = ?", (chat_id,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def data_size(self, chat_id: int) -> int:
+        row = self._db.execute(
+            "SELECT sample_bytes FROM chats WHERE chat_id = ?", (chat_id,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def sync(self, chat_id: int) -> None:
+        pass
+
+    def stage_rewrite(self, chat_id: int, records: list[SampleRecord]) -> list[SampleRecord]:
+        return records
+
+    def commit_rewrite(self, chat_id: int, staged: list[SampleRecord], end: int) -> None:
+        with self._lock, self._db:
+            self._db.execute("BEGIN")
+            self._db.execute("DELETE FROM samples WHERE chat_id = ? AND id <= ?", (chat_id, end))
+            self._db.executemany(
+                "INSERT INTO samples (chat_id, text, weight, created_at) VALUES (?, ?, ?, ?)",
+                [(chat_id, text, weight, created_at) for text, weight, created_at in staged],
+            )
+            self._db.execute(
+                "UPDATE chats SET "
+                "sample_count = (SELECT coalesce(sum(weight), 0) FROM samples WHERE chat_id = ?), "
+                "sample_bytes = (SELECT coalesce(sum(length(CAST(text AS BLOB)) + 1), 0) "
+                "FROM samples WHERE chat_id = ?) "
+                "WHERE chat_id = ?",
+                (chat_id, chat_id, chat_id),
+            )
+
+    def discard_rewrite(self, staged: list[SampleRecord]) -> None:
+        pass
+
+    def load_settings(self, chat_id: int) -> Optional[dict[str, Any]]:
+        row = self._db.execute(
+            "SELECT data FROM settings WHERE chat_id = ?", (chat_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        try:
+            return json.loads(row[0])
+        except Exception:
+            return None
+
+    def save_settings(self, chat_id: int, data: dict[str, Any]) -> None:
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO settings (chat_id, data) VALUES (?, ?) "
+                "ON CONFLICT (chat_id) DO UPDATE SET data = excluded.data",
+                (chat_id, json.dumps(data, ensure_ascii=False)),
+            )
+
+    def release(self, chat_id: int) -> None:
+        pass
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
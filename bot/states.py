@@ -5,3 +5,4 @@ class SettingsForm(StatesGroup):
     waiting_chance = State()
     waiting_maxlen = State()
     waiting_minsamples = State()
+    waiting_retention = State()
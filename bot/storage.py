@@ -1,71 +1,611 @@
 from __future__ import annotations
 
-import json
-from dataclasses import asdict
+import asyncio
+import contextlib
+import logging
+import sys
+import time
+from dataclasses import asdict, replace
 from pathlib import Path
+from typing import Any, Callable, Iterator, Optional
 
+from .backends import StorageBackend
+from .cache import LRUCache
+from .chain import ChainModel
+from .iopool import ChatIOPool
+from .journal import SampleJournal
+from .metrics import DISK_READ_BYTES, DISK_WRITE_BYTES, MESSAGES_STORED
 from .models import ChatSettings
+from .redis_store import SharedSettingsCache
+from .registry import ChatRegistry
+from .retention import RetentionPolicy, compact_records
+from .snapshot import dump_snapshot, read_snapshot, write_snapshot
+
+
+logger = logging.getLogger(__name__)
+
+
+def _samples_size(samples: list[str]) -> int:
+    return sys.getsizeof(samples) + sum(map(sys.getsizeof, samples))
+
+
+def _metered(samples: Iterator[str]) -> Iterator[str]:
+    size = 0
+    for sample in samples:
+        size += len(sample.encode("utf8")) + 1
+        yield sample
+    DISK_READ_BYTES.observe(size)
+
+
+def _metered_weighted(samples: Iterator[tuple[str, int]]) -> Iterator[tuple[str, int]]:
+    size = 0
+    for sample, weight in samples:
+        size += len(sample.encode("utf8")) + 1
+        yield sample, weight
+    DISK_READ_BYTES.observe(size)
+
+
+def clean_sample(text: str) -> str:
+    return text.replace("\n", " ").replace("\x01", "").strip()
+
+
+class _Frozen:
+    __slots__ = ("model", "holds", "held", "thawed")
+
+    def __init__(self, model: ChainModel):
+        self.model = model
+        self.holds = 0
+        # samples appended while the model was held
+        self.held: list[str] = []
+        self.thawed = asyncio.get_running_loop().create_future()
+
+
+def _parse_settings(data: Optional[dict]) -> Optional[ChatSettings]:
+    if data is None:
+        return None
+    try:
+        return ChatSettings(**data)
+    except Exception:
+        return None
 
 
 class ChatStorage:
-    def __init__(self, dialogs_dir: Path, settings_dir: Path):
-        self.dialogs_dir = dialogs_dir
-        self.settings_dir = settings_dir
-        self.ensure_dirs()
+    def __init__(
+        self,
+        backend: StorageBackend,
+        cache_max_chats: int = 1024,
+        cache_max_bytes: int = 64 * 1024 * 1024,
+        journal_max_batch: int = 256,
+        journal_flush_interval: float = 1.0,
+        novelty_index: str = "exact",
+        snapshot_dir: Optional[Path] = None,
+        snapshot_every: int = 1000,
+        compact_every: int = 5000,
+        shared_settings: Optional[SharedSettingsCache] = None,
+        chat_idle_ttl: float = 3600.0,
+        sweep_interval: float = 60.0,
+        io_workers: int = 0,
+    ):
+        self.backend = backend
+        self.novelty_index = novelty_index
+        self.snapshot_dir = snapshot_dir
+        self.snapshot_every = snapshot_every
+        self.compact_every = compact_every
+        self.shared_settings = shared_settings
+        self.sweep_interval = sweep_interval
+        self.registry = ChatRegistry(chat_idle_ttl)
+        self._chains: dict[int, ChainModel] = {}
+        self._settings_cache: LRUCache[int, ChatSettings] = LRUCache(cache_max_chats)
+        self._samples_cache: LRUCache[int, list[str]] = LRUCache(
+            cache_max_chats, cache_max_bytes, _samples_size
+        )
+        # without an I/O pool the async API runs backend calls inline
+        self.io = ChatIOPool(io_workers) if io_workers > 0 else None
+        self.journal = SampleJournal(
+            self._write_batch,
+            max_batch=journal_max_batch,
+            flush_interval=journal_flush_interval,
+            submit=self._submit_batch if self.io is not None else None,
+        )
+        self._unsnapshotted: dict[int, int] = {}
+        self._epochs: dict[int, int] = {}
+        self._snapshot_tasks: dict[int, asyncio.Task] = {}
+        # models read by other threads; appends to them wait meanwhile
+        self._frozen: dict[int, _Frozen] = {}
+        self._uncompacted: dict[int, int] = {}
+        self._compaction_tasks: dict[int, asyncio.Task] = {}
+        # samples appended while a load or compaction is waiting on I/O
+        self._tails: dict[int, list[list[str]]] = {}
+        self._loading: dict[tuple[int, int], asyncio.Future] = {}
+        self._sweep_task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        self.journal.start()
+        if self.registry.idle_ttl > 0 and self._sweep_task is None:
+            self._sweep_task = asyncio.get_running_loop().create_task(self._sweep())
+
+    async def close(self) -> None:
+        if self._sweep_task is not None:
+            self._sweep_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._sweep_task
+            self._sweep_task = None
+        if self._compaction_tasks:
+            await asyncio.gather(*self._compaction_tasks.values(), return_exceptions=True)
+        if self._snapshot_tasks:
+            await asyncio.gather(*self._snapshot_tasks.values(), return_exceptions=True)
+        if self._loading:
+            await asyncio.gather(*self._loading.values(), return_exceptions=True)
+        await self.journal.close()
+        if self.io is not None:
+            await self.io.drain()
+        if self._unsnapshotted:
+            await asyncio.gather(*map(self._snapshot_chain, list(self._unsnapshotted)))
+        if self.shared_settings is not None:
+            await self.shared_settings.close()
+        self.backend.close()
+        if self.io is not None:
+            self.io.shutdown()
+
+    def snapshot_path(self, chat_id: int) -> Optional[Path]:
+        if self.snapshot_dir is None or self.snapshot_every <= 0:
+            return None
+        return self.snapshot_dir / f"{chat_id}.bin"
 
-    def ensure_dirs(self) -> None:
-        self.dialogs_dir.mkdir(parents=True, exist_ok=True)
-        self.settings_dir.mkdir(parents=True, exist_ok=True)
+    def activate(self, chat_id: int) -> None:
+        self.registry.touch(chat_id)
 
-    def dialog_path(self, chat_id: int) -> Path:
-        return self.dialogs_dir / f"{chat_id}.txt"
+    async def evict(self, chat_id: int) -> bool:
+        busy = (self._snapshot_tasks, self._compaction_tasks, self._tails, self._frozen)
+        loading = any(key[0] == chat_id for key in self._loading)
+        if loading or any(chat_id in tasks for tasks in busy):
+            self.registry.touch(chat_id)
+            return False
 
-    def settings_path(self, chat_id: int) -> Path:
-        return self.settings_dir / f"{chat_id}.json"
+        self.registry.forget(chat_id)
+        path = self.snapshot_path(chat_id)
+        epoch = self._epochs.get(chat_id, 0)
+        model = self._chains.pop(chat_id, None)
+        save = None
+        if model is not None and self._unsnapshotted.pop(chat_id, None) is not None:
+            # nothing can change the model once it is out of `_chains`
+            save = self._submit_flushed(chat_id, self._save_snapshot, chat_id, path, model)
+        else:
+            self._queue_journal(chat_id)
+        self._uncompacted.pop(chat_id, None)
+        self._settings_cache.pop(chat_id)
+        self._samples_cache.pop(chat_id)
+        release = self._submit(chat_id, self.backend.release, chat_id)
+        if save is not None:
+            await save
+            self._check_snapshot(chat_id, path, epoch)
+        await release
+        if chat_id not in self.registry:
+            self._epochs.pop(chat_id, None)
+        return True
 
-    def ensure_chat(self, chat_id: int) -> None:
-        self.ensure_dirs()
-        path = self.dialog_path(chat_id)
-        if not path.exists():
-            path.write_text("", encoding="utf8")
+    async def _sweep(self) -> None:
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            for chat_id in self.registry.expired():
+                try:
+                    await self.evict(chat_id)
+                except Exception:
+                    logger.exception("Failed to evict chat %s", chat_id)
 
     def load_samples(self, chat_id: int) -> list[str]:
-        self.ensure_dirs()
-        path = self.dialog_path(chat_id)
-        if not path.exists():
-            return []
-        try:
-            lines = path.read_text(encoding="utf8").splitlines()
-        except Exception:
-            return []
-        return [line.strip() for line in lines if line.strip()]
+        cached = self._samples_cache.get(chat_id)
+        if cached is not None:
+            return list(cached)
+
+        self.journal.flush_chat(chat_id)
+        samples = list(_metered(self.backend.iter_samples(chat_id)))
+        self._samples_cache.put(chat_id, samples)
+        return list(samples)
+
+    def iter_samples(self, chat_id: int) -> Iterator[str]:
+        cached = self._samples_cache.get(chat_id)
+        if cached is not None:
+            return iter(list(cached))
+
+        self.journal.flush_chat(chat_id)
+        return _metered(self.backend.iter_samples(chat_id))
 
     def append_sample(self, chat_id: int, text: str) -> None:
-        self.ensure_dirs()
-        normalized = text.replace("\n", " ").strip()
-        with self.dialog_path(chat_id).open("a", encoding="utf8") as file:
-            file.write(normalized + "\n")
+        normalized = clean_sample(text)
+        if not normalized:
+            return
+
+        self.journal.append(chat_id, normalized)
+        self.registry.touch(chat_id)
+        MESSAGES_STORED.inc()
+        for tail in self._tails.get(chat_id, ()):
+            tail.append(normalized)
+        self._mark_uncompacted(chat_id, 1)
+
+        cached = self._samples_cache.peek(chat_id)
+        if cached is not None:
+            cached.append(normalized)
+            self._samples_cache.resize(chat_id, sys.getsizeof(normalized))
+
+        model = self._chains.get(chat_id)
+        frozen = self._frozen.get(chat_id)
+        if frozen is not None and frozen.model is model:
+            frozen.held.append(normalized)
+        elif model is not None:
+            model.add_sample(normalized)
+            self._mark_unsnapshotted(chat_id, 1)
 
     def clear_samples(self, chat_id: int) -> None:
-        self.ensure_dirs()
-        self.dialog_path(chat_id).write_text("", encoding="utf8")
+        self.journal.discard(chat_id)
+        self._clear_on_disk(chat_id)
+        self._forget_samples(chat_id)
 
-    def load_settings(self, chat_id: int) -> ChatSettings:
-        self.ensure_dirs()
-        path = self.settings_path(chat_id)
-        if not path.exists():
-            settings = ChatSettings()
-            self.save_settings(chat_id, settings)
-            return settings
+    async def aclear_samples(self, chat_id: int) -> None:
+        # pending lines are dropped and earlier queued writes land before the
+        # clear, so nothing appended before this call survives it
+        self.journal.discard(chat_id)
+        self._forget_samples(chat_id)
+        await self._submit(chat_id, self._clear_on_disk, chat_id)
+
+    def _clear_on_disk(self, chat_id: int) -> None:
+        self._drop_snapshot(chat_id)
+        self.backend.clear_samples(chat_id)
+
+    def _commit_rewrite(self, chat_id: int, rewrite: Any, end: int) -> None:
+        self._drop_snapshot(chat_id)
+        self.backend.commit_rewrite(chat_id, rewrite, end)
+
+    def _drop_snapshot(self, chat_id: int) -> None:
+        # The snapshot goes before the dialog changes under it, in the same
+        # I/O job: a crash in between must not leave an offset into a
+        # truncated or rewritten file.
+        path = self.snapshot_path(chat_id)
+        if path is not None:
+            path.unlink(missing_ok=True)
+
+    def _forget_samples(self, chat_id: int) -> None:
+        self.registry.touch(chat_id)
+        self._samples_cache.put(chat_id, [])
+        self._chains.pop(chat_id, None)
+        self._unsnapshotted.pop(chat_id, None)
+        self._uncompacted.pop(chat_id, None)
+        self._epochs[chat_id] = self._epochs.get(chat_id, 0) + 1
+
+    def _invalidate_snapshot(self, chat_id: int) -> None:
+        self._epochs[chat_id] = self._epochs.get(chat_id, 0) + 1
+        path = self.snapshot_path(chat_id)
+        if path is not None:
+            path.unlink(missing_ok=True)
+
+    def count_samples(self, chat_id: int) -> int:
+        model = self._chains.get(chat_id)
+        if model is not None:
+            return model.sample_count
+        cached = self._samples_cache.peek(chat_id)
+        if cached is not None:
+            return len(cached)
+        self.journal.flush_chat(chat_id)
+        return self.backend.count_samples(chat_id)
+
+    async def acount_samples(self, chat_id: int) -> int:
+        model = self._chains.get(chat_id)
+        if model is not None:
+            return model.sample_count
+        cached = self._samples_cache.peek(chat_id)
+        if cached is not None:
+            return len(cached)
+        return await self._submit_flushed(chat_id, self.backend.count_samples, chat_id)
+
+    def dialog_size(self, chat_id: int) -> int:
+        self.journal.flush_chat(chat_id)
+        return self.backend.data_size(chat_id)
+
+    async def adialog_size(self, chat_id: int) -> int:
+        return await self._submit_flushed(chat_id, self.backend.data_size, chat_id)
+
+    def chain(self, chat_id: int, order: int = 1) -> ChainModel:
+        self.registry.touch(chat_id)
+        model = self._chains.get(chat_id)
+        if model is None or model.order != order:
+            cached = self._samples_cache.get(chat_id)
+            samples = None if cached is None else list(cached)
+            self.journal.flush_chat(chat_id)
+            model, fresh = self._read_chain(chat_id, order, samples)
+            self._install_chain(chat_id, model, fresh)
+        return model
+
+    async def achain(self, chat_id: int, order: int = 1) -> ChainModel:
+        self.registry.touch(chat_id)
+        model = self._chains.get(chat_id)
+        if model is not None and model.order == order:
+            return model
+        key = (chat_id, order)
+        loading = self._loading.get(key)
+        if loading is None:
+            loading = asyncio.ensure_future(self._aload_chain(chat_id, order))
+            self._loading[key] = loading
+            loading.add_done_callback(lambda _: self._loading.pop(key, None))
+        return await asyncio.shield(loading)
+
+    async def _aload_chain(self, chat_id: int, order: int) -> ChainModel:
+        while True:
+            epoch = self._epochs.get(chat_id, 0)
+            cached = self._samples_cache.get(chat_id)
+            samples = None if cached is None else list(cached)
+            with self._collect_tail(chat_id) as tail:
+                model, fresh = await self._submit_flushed(
+                    chat_id, self._read_chain, chat_id, order, samples
+                )
+            if self._epochs.get(chat_id, 0) == epoch:
+                break
+        for sample in tail:
+            model.add_sample(sample)
+        current = self._chains.get(chat_id)
+        if current is not None and current.order == order:
+            return current
+        self._install_chain(chat_id, model, fresh + len(tail))
+        return model
+
+    def _read_chain(
+        self,
+        chat_id: int,
+        order: int,
+        cached: Optional[list[str]],
+    ) -> tuple[ChainModel, int]:
+        # pending journal lines must already be written; returns the model and
+        # how many of its samples are not covered by a snapshot
+        path = self.snapshot_path(chat_id)
+        loaded = read_snapshot(path, order) if path is not None else None
+        if loaded is not None:
+            model, offset = loaded
+            current = self.backend.sample_offset(chat_id)
+            if model.index_kind == self.novelty_index and offset <= current:
+                replayed = 0
+                for sample in _metered(self.backend.iter_samples_from(chat_id, offset)):
+                    model.add_sample(sample)
+                    replayed += 1
+                return model, replayed
+
+        if cached is not None:
+            model = ChainModel.from_samples(cached, self.novelty_index, order)
+        else:
+            weighted = _metered_weighted(self.backend.iter_weighted(chat_id))
+            model = ChainModel.from_weighted(weighted, self.novelty_index, order)
+        return model, model.sample_count
+
+    def _install_chain(self, chat_id: int, model: ChainModel, fresh: int) -> None:
+        self._chains[chat_id] = model
+        self._unsnapshotted.pop(chat_id, None)
+        self._mark_unsnapshotted(chat_id, fresh)
+
+    def _write_batch(self, chat_id: int, lines: list[str]) -> None:
+        self.backend.append_samples(chat_id, lines)
+        DISK_WRITE_BYTES.observe(sum(len(line.encode("utf8")) + 1 for line in lines))
+
+    def _submit_batch(self, chat_id: int, lines: list[str]) -> asyncio.Future:
+        return self._submit(chat_id, self._write_batch, chat_id, lines)
+
+    def _submit(self, chat_id: int, func: Callable[..., Any], *args: Any) -> asyncio.Future:
+        if self.io is not None:
+            return self.io.submit(chat_id, func, *args)
+        future = asyncio.get_running_loop().create_future()
         try:
-            data = json.loads(path.read_text(encoding="utf8"))
-            return ChatSettings(**data)
-        except Exception:
-            settings = ChatSettings()
-            self.save_settings(chat_id, settings)
-            return settings
+            future.set_result(func(*args))
+        except Exception as exc:
+            future.set_exception(exc)
+        return future
+
+    def _submit_flushed(self, chat_id: int, func: Callable[..., Any], *args: Any) -> asyncio.Future:
+        # queues the chat's pending journal lines ahead of the call
+        self._queue_journal(chat_id)
+        return self._submit(chat_id, func, *args)
+
+    def _queue_journal(self, chat_id: int) -> None:
+        write = self.journal.submit_chat(chat_id)
+        if write is not None:
+            asyncio.ensure_future(write).add_done_callback(SampleJournal.log_failure)
+
+    @contextlib.contextmanager
+    def _collect_tail(self, chat_id: int) -> Iterator[list[str]]:
+        tail: list[str] = []
+        tails = self._tails.setdefault(chat_id, [])
+        tails.append(tail)
+        try:
+            yield tail
+        finally:
+            tails[:] = [other for other in tails if other is not tail]
+            if not tails:
+                self._tails.pop(chat_id, None)
+
+    def _mark_unsnapshotted(self, chat_id: int, count: int) -> None:
+        if count <= 0 or self.snapshot_path(chat_id) is None:
+            return
+        pending = self._unsnapshotted.get(chat_id, 0) + count
+        self._unsnapshotted[chat_id] = pending
+        if pending >= self.snapshot_every and chat_id not in self._snapshot_tasks:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                return
+            task = loop.create_task(self._snapshot_chain(chat_id))
+            self._snapshot_tasks[chat_id] = task
+            task.add_done_callback(lambda _: self._snapshot_tasks.pop(chat_id, None))
+
+    def _save_snapshot(self, chat_id: int, path: Path, model: ChainModel) -> None:
+        # runs on the chat's I/O worker right after the pending lines the model
+        # already holds are written, so the offset matches the pickled state and
+        # the file cannot land after a later rewrite of the dialog
+        write_snapshot(path, dump_snapshot(model, self.backend.sample_offset(chat_id)))
+
+    def _check_snapshot(self, chat_id: int, path: Path, epoch: int) -> None:
+        if self._epochs.get(chat_id, 0) != epoch:
+            path.unlink(missing_ok=True)
+
+    @contextlib.contextmanager
+    def hold_chain(self, chat_id: int, model: ChainModel) -> Iterator[None]:
+        # Appends to `model` are held back inside the block and applied when
+        # the last hold ends, so other threads can read or pickle it meanwhile.
+        if self._chains.get(chat_id) is not model:
+            # nothing appends to a chain the chat no longer uses
+            yield
+            return
+        frozen = self._frozen.get(chat_id)
+        if frozen is None or frozen.model is not model:
+            frozen = self._frozen[chat_id] = _Frozen(model)
+        frozen.holds += 1
+        try:
+            yield
+        finally:
+            frozen.holds -= 1
+            if not frozen.holds:
+                frozen.thawed.set_result(None)
+            if not frozen.holds and self._frozen.get(chat_id) is frozen:
+                del self._frozen[chat_id]
+                # held samples go to the model and the next snapshot
+                if self._chains.get(chat_id) is model:
+                    for sample in frozen.held:
+                        model.add_sample(sample)
+                    self._mark_unsnapshotted(chat_id, len(frozen.held))
+
+    async def _snapshot_chain(self, chat_id: int) -> None:
+        path = self.snapshot_path(chat_id)
+        if path is None:
+            return
+        # lines held back by another reader must not be counted in the offset
+        while chat_id in self._frozen:
+            await asyncio.shield(self._frozen[chat_id].thawed)
+        model = self._chains.get(chat_id)
+        self._unsnapshotted.pop(chat_id, None)
+        if model is None:
+            return
+        epoch = self._epochs.get(chat_id, 0)
+        with self.hold_chain(chat_id, model):
+            await self._submit_flushed(chat_id, self._save_snapshot, chat_id, path, model)
+        self._check_snapshot(chat_id, path, epoch)
+
+    def _mark_uncompacted(self, chat_id: int, count: int) -> None:
+        if self.compact_every <= 0:
+            return
+        pending = self._uncompacted.get(chat_id, 0) + count
+        self._uncompacted[chat_id] = pending
+        if pending >= self.compact_every:
+            self.schedule_compaction(chat_id)
+
+    def schedule_compaction(self, chat_id: int) -> None:
+        if chat_id in self._compaction_tasks:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        task = loop.create_task(self.compact(chat_id))
+        self._compaction_tasks[chat_id] = task
+        task.add_done_callback(lambda _: self._compaction_tasks.pop(chat_id, None))
+
+    async def compact(self, chat_id: int) -> bool:
+        policy = RetentionPolicy.from_settings(await self._aload_local_settings(chat_id))
+        epoch = self._epochs.get(chat_id, 0)
+        model = self._chains.get(chat_id)
+        order = model.order if model is not None else None
+        self._uncompacted.pop(chat_id, None)
+        with self._collect_tail(chat_id) as tail:
+            end = await self._submit_flushed(chat_id, self.backend.sample_offset, chat_id)
+            staged = await asyncio.to_thread(self._stage_compaction, chat_id, end, policy, order)
+            if staged is None:
+                return False
+
+            rewrite, dropped, rebuilt = staged
+            if self._epochs.get(chat_id, 0) != epoch:
+                self.backend.discard_rewrite(rewrite)
+                return False
+            await self._submit_flushed(chat_id, self._commit_rewrite, chat_id, rewrite, end)
+        if self._epochs.get(chat_id, 0) != epoch:
+            return True
+        self._samples_cache.pop(chat_id)
+        self._unsnapshotted.pop(chat_id, None)
+        self._invalidate_snapshot(chat_id)
+
+        current = self._chains.get(chat_id)
+        if current is not None and dropped:
+            if rebuilt is not None and rebuilt.order == current.order:
+                for sample in tail:
+                    rebuilt.add_sample(sample)
+                current = self._chains[chat_id] = rebuilt
+            else:
+                self._chains.pop(chat_id, None)
+                current = None
+        if current is not None:
+            self._mark_unsnapshotted(chat_id, current.sample_count)
+        return True
+
+    def _stage_compaction(
+        self,
+        chat_id: int,
+        end: int,
+        policy: RetentionPolicy,
+        order: Optional[int],
+    ) -> Optional[tuple[object, int, Optional[ChainModel]]]:
+        records = list(self.backend.iter_records(chat_id, end))
+        compacted, dropped = compact_records(records, policy, int(time.time()))
+        if not dropped and len(compacted) == len(records) and all(ts for _, _, ts in records):
+            return None
+        rewrite = self.backend.stage_rewrite(chat_id, compacted)
+        rebuilt = None
+        if dropped and order is not None:
+            rebuilt = ChainModel.from_weighted(
+                ((text, weight) for text, weight, _ in compacted), self.novelty_index, order
+            )
+        return rewrite, dropped, rebuilt
+
+    def load_settings(self, chat_id: int) -> ChatSettings:
+        self.registry.touch(chat_id)
+        cached = self._settings_cache.get(chat_id)
+        if cached is not None:
+            return replace(cached)
+
+        settings = _parse_settings(self.backend.load_settings(chat_id)) or ChatSettings()
+        self._settings_cache.put(chat_id, replace(settings))
+        return settings
 
     def save_settings(self, chat_id: int, settings: ChatSettings) -> None:
-        self.ensure_dirs()
-        payload = json.dumps(asdict(settings), ensure_ascii=False, indent=2)
-        self.settings_path(chat_id).write_text(payload, encoding="utf8")
+        self.backend.save_settings(chat_id, asdict(settings))
+        self._settings_cache.put(chat_id, replace(settings))
+
+    async def aload_settings(self, chat_id: int) -> ChatSettings:
+        self.registry.touch(chat_id)
+        if self.shared_settings is None:
+            return await self._aload_local_settings(chat_id)
+
+        settings = _parse_settings(await self.shared_settings.get(chat_id))
+        if settings is not None:
+            return settings
+        data = await self._submit(chat_id, self.backend.load_settings, chat_id)
+        settings = _parse_settings(data) or ChatSettings()
+        await self.shared_settings.set(chat_id, asdict(settings))
+        return settings
+
+    async def _aload_local_settings(self, chat_id: int) -> ChatSettings:
+        cached = self._settings_cache.get(chat_id)
+        if cached is None:
+            data = await self._submit(chat_id, self.backend.load_settings, chat_id)
+            # a save queued behind the read has already updated the cache
+            cached = self._settings_cache.peek(chat_id)
+            if cached is None:
+                cached = _parse_settings(data) or ChatSettings()
+                self._settings_cache.put(chat_id, replace(cached))
+        return replace(cached)
+
+    async def asave_settings(self, chat_id: int, settings: ChatSettings) -> None:
+        data = asdict(settings)
+        self._settings_cache.put(chat_id, replace(settings))
+        write = self._submit(chat_id, self.backend.save_settings, chat_id, data)
+        if self.shared_settings is not None:
+            await self.shared_settings.set(chat_id, data)
+        await write
+
+    def cache_stats(self) -> dict[str, dict[str, int]]:
+        return {
+            "settings": self._settings_cache.stats(),
+            "samples": self._samples_cache.stats(),
+        }
@@ -0,0 +1,76 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+from typing import Any, Iterator, TextIO
+
+_CHUNK_SIZE = 1 << 20
+_MESSAGES_KEY = '"messages"'
+_CHANNEL_TYPES = ("private_supergroup", "public_supergroup", "private_channel", "public_channel")
+
+
+def bot_chat_id(chat_type: str, export_id: int) -> int:
+    if chat_type in _CHANNEL_TYPES:
+        return -(10**12 + export_id)
+    if chat_type == "private_group":
+        return -export_id
+    return export_id
+
+
+def message_text(message: dict[str, Any]) -> str:
+    text = message.get("text", "")
+    if isinstance(text, list):
+        return "".join(part if isinstance(part, str) else part.get("text", "") for part in text)
+    return text if isinstance(text, str) else ""
+
+
+def read_export(path: Path) -> tuple[dict[str, Any], Iterator[dict[str, Any]]]:
+    file = path.open(encoding="utf8")
+    buffer = ""
+    while (index := buffer.find(_MESSAGES_KEY)) < 0:
+        chunk = file.read(_CHUNK_SIZE)
+        if not chunk:
+            file.close()
+            raise ValueError(f"{path} has no messages array")
+        buffer += chunk
+
+    try:
+        header = json.loads(buffer[:index].rstrip().rstrip(",") + "}")
+    except ValueError as exc:
+        file.close()
+        raise ValueError(f"{path} is not a single-chat Telegram export") from exc
+    return header, _iter_messages(file, buffer[index + len(_MESSAGES_KEY):])
+
+
+def _iter_messages(file: TextIO, buffer: str) -> Iterator[dict[str, Any]]:
+    decoder = json.JSONDecoder()
+    position = 0
+    opened = False
+    with file:
+        while True:
+            while position < len(buffer) and buffer[position] in " \t\r\n,:[":
+                opened = opened or buffer[position] == "["
+                position += 1
+            if position >= len(buffer):
+                chunk = file.read(_CHUNK_SIZE)
+                if not chunk:
+                    return
+                buffer = chunk
+                position = 0
+                continue
+            if not opened:
+                raise ValueError("messages is not an array")
+            if buffer[position] == "]":
+                return
+
+            try:
+                message, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                chunk = file.read(_CHUNK_SIZE)
+                if not chunk:
+                    raise
+                buffer = buffer[position:] + chunk
+                position = 0
+                continue
+            if isinstance(message, dict) and message.get("type", "message") == "message":
+                yield message
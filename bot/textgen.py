@@ -1,73 +1,106 @@
 from __future__ import annotations
 
 import random
-from random import choice
 from typing import Optional
 
+from .chain import ChainModel
 from .models import ChatSettings
 
-_START = "___start___"
-_END = "___end___"
+try:
+    from .batch import walk_batch
+except ImportError:  # numpy is optional; batches fall back to scalar walks
+    walk_batch = None
 
+_SIZE_BOUNDS = {0: (1, 100), 1: (2, 3), 2: (4, 7), 3: (8, 100)}
+BATCH_MAX_STALE = 64
+# Lockstep walks cost as many numpy steps as the longest one takes, which only
+# pays off for bounded sizes and enough walks per step. Reply-pool refills ask
+# for a handful of texts, so only bulk callers such as bench.py get here.
+BATCH_MAX_LEN = 16
+BATCH_MIN_WALKS = 32
 
-def generate(samples: list[str], tries_count: int = 200, size: int = 0) -> Optional[str]:
-    if not samples:
-        return None
 
-    frames: list[str] = []
-    start_frames: list[str] = []
-    frame_map: dict[str, list[str]] = {}
+def _size_bounds(size: int) -> tuple[int, int]:
+    bounds = _SIZE_BOUNDS.get(size)
+    if bounds is None:
+        raise ValueError("Size must be 0, 1, 2 or 3")
+    return bounds
 
-    for sample in samples:
-        words = sample.split()
-        if not words:
-            continue
-        frames.append(_START)
-        frames.extend(words)
-        frames.append(_END)
-
-    for i in range(len(frames) - 1):
-        cur = frames[i]
-        nxt = frames[i + 1]
-        if cur == _END:
-            continue
-        frame_map.setdefault(cur, []).append(nxt)
-        if cur == _START:
-            start_frames.append(nxt)
-
-    if not start_frames:
-        return None
-
-    max_tokens = 100
-    for _ in range(tries_count):
-        result = [choice(start_frames)]
-        for _ in range(max_tokens):
-            frame = result[-1]
-            nxt = choice(frame_map.get(frame, [_END]))
-            if nxt == _END:
-                break
-            result.append(nxt)
-        else:
-            continue
 
-        str_result = " ".join(result)
+def generate(model: ChainModel, tries_count: int = 200, size: int = 0) -> Optional[str]:
+    return generate_counted(model, tries_count, size)[0]
 
-        if str_result in samples:
+
+def generate_counted(
+    model: ChainModel,
+    tries_count: int = 200,
+    size: int = 0,
+) -> tuple[Optional[str], int]:
+    min_len, max_len = _size_bounds(size)
+    if not model.sample_count:
+        return None, 0
+
+    for tries in range(1, tries_count + 1):
+        result = model.walk(min_len=min_len, max_len=max_len)
+        if result is None:
             continue
 
-        n = len(result)
-        if size == 0 and n <= 100:
-            return str_result
-        if size == 1 and 2 <= n <= 3:
-            return str_result
-        if size == 2 and 4 <= n <= 7:
-            return str_result
-        if size == 3 and 8 <= n <= 100:
-            return str_result
-        if size not in (0, 1, 2, 3):
-            raise ValueError("Size must be 0, 1, 2 or 3")
-
-    return None
+        str_result = " ".join(result)
+        if model.is_known(str_result):
+            continue
+        return str_result, tries
+
+    return None, tries_count
+
+
+def generate_batch(
+    model: ChainModel,
+    count: int,
+    tries_count: int = 200,
+    size: int = 0,
+) -> list[str]:
+    return generate_batch_counted(model, count, tries_count, size)[0]
+
+
+def generate_batch_counted(
+    model: ChainModel,
+    count: int,
+    tries_count: int = 200,
+    size: int = 0,
+    version: Optional[int] = None,
+) -> tuple[list[str], int]:
+    # `version` must be read on the thread that appends to the model when the
+    # model is shared with it, see compile_chain
+    min_len, max_len = _size_bounds(size)
+    if not model.sample_count or count <= 0:
+        return [], 0
+    vectorized = walk_batch is not None and model.order == 1 and max_len <= BATCH_MAX_LEN
+
+    results: list[str] = []
+    seen: set[str] = set()
+    walks = 0
+    while len(results) < count and walks < tries_count:
+        # vectorized walks draw spares to cover duplicates and known lines
+        missing = count - len(results)
+        chunk = min(tries_count - walks, missing * 2 if vectorized else missing)
+        walked = None
+        if vectorized and chunk >= BATCH_MIN_WALKS:
+            walked = walk_batch(model, chunk, min_len, max_len, BATCH_MAX_STALE, version)
+        if walked is None:
+            walked = [
+                " ".join(words)
+                for words in (model.walk(min_len, max_len) for _ in range(chunk))
+                if words is not None
+            ]
+        walks += chunk
+        for text in walked:
+            if text in seen or model.is_known(text):
+                continue
+            seen.add(text)
+            results.append(text)
+            if len(results) == count:
+                break
+    return results, walks
 
 
 def size_to_name(size: int) -> str:
@@ -0,0 +1,118 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import logging
+import secrets
+import signal
+from typing import Optional
+
+from aiogram import Bot, Dispatcher
+from aiohttp import web
+
+from .config import AppConfig
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookServer:
+    def __init__(
+        self,
+        dispatcher: Dispatcher,
+        bot: Bot,
+        path: str = "/webhook",
+        secret_token: Optional[str] = None,
+        max_concurrency: int = 64,
+    ):
+        self.dispatcher = dispatcher
+        self.bot = bot
+        self.path = path
+        self.secret_token = secret_token
+        self.accepting = True
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._tasks: set[asyncio.Task] = set()
+
+    @property
+    def inflight(self) -> int:
+        return len(self._tasks)
+
+    def build_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        return app
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if self.secret_token and not secrets.compare_digest(
+            request.headers.get(SECRET_HEADER, ""), self.secret_token
+        ):
+            return web.Response(status=401)
+        if not self.accepting:
+            return web.Response(status=503)
+        try:
+            update = await request.json()
+        except Exception:
+            return web.Response(status=400)
+
+        await self._semaphore.acquire()
+        task = asyncio.create_task(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._release)
+        return web.Response()
+
+    async def drain(self, timeout: float) -> None:
+        self.accepting = False
+        if self._tasks:
+            await asyncio.wait(set(self._tasks), timeout=timeout)
+
+    async def _process(self, update: dict) -> None:
+        try:
+            await self.dispatcher.feed_raw_update(self.bot, update)
+        except Exception:
+            logger.exception("Failed to process update %s", update.get("update_id"))
+
+    def _release(self, task: asyncio.Task) -> None:
+        self._tasks.discard(task)
+        self._semaphore.release()
+
+
+async def run_webhook(dispatcher: Dispatcher, bot: Bot, config: AppConfig) -> None:
+    server = WebhookServer(
+        dispatcher,
+        bot,
+        path=config.webhook_path,
+        secret_token=config.webhook_secret or None,
+        max_concurrency=config.webhook_max_concurrency,
+    )
+    runner = web.AppRunner(server.build_app())
+    await runner.setup()
+    site = web.TCPSite(runner, config.webhook_host, config.webhook_port)
+    await site.start()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        with contextlib.suppress(NotImplementedError, RuntimeError):
+            loop.add_signal_handler(sig, stop.set)
+
+    try:
+        if config.webhook_url:
+            await bot.set_webhook(
+                config.webhook_url,
+                secret_token=config.webhook_secret or None,
+                max_connections=min(100, config.webhook_max_concurrency),
+                drop_pending_updates=True,
+            )
+        await dispatcher.emit_startup(bot=bot, dispatcher=dispatcher)
+        await stop.wait()
+    finally:
+        server.accepting = False
+        await site.stop()
+        await server.drain(config.webhook_drain_timeout)
+        await runner.cleanup()
+        await dispatcher.emit_shutdown(bot=bot, dispatcher=dispatcher)
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            with contextlib.suppress(NotImplementedError, RuntimeError):
+                loop.remove_signal_handler(sig)
+        await bot.session.close()
@@ -0,0 +1,196 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import replace
+from pathlib import Path
+from typing import Iterator, Optional
+
+from bot.backends import open_backend
+from bot.config import AppConfig
+from bot.storage import ChatStorage, clean_sample
+from bot.telegram_export import bot_chat_id, message_text, read_export
+from bot.textgen import is_allowed_text
+
+
+def open_storage(config: AppConfig) -> ChatStorage:
+    return ChatStorage(
+        open_backend(config),
+        novelty_index=config.novelty_index,
+        snapshot_dir=config.snapshot_dir,
+        snapshot_every=max(1, config.snapshot_every),
+        compact_every=0,
+    )
+
+
+def read_source(path: Path, fmt: str, chat_id: Optional[int]) -> tuple[int, Iterator[str]]:
+    if fmt == "auto":
+        fmt = "telegram" if path.suffix == ".json" else "lines"
+    if fmt == "lines":
+        if chat_id is None:
+            raise SystemExit(f"{path}: --chat-id is required for plain-text imports")
+        return chat_id, _read_lines(path)
+
+    header, messages = read_export(path)
+    if chat_id is None:
+        chat_id = bot_chat_id(header.get("type", ""), int(header["id"]))
+    return chat_id, (message_text(message) for message in messages)
+
+
+def _read_lines(path: Path) -> Iterator[str]:
+    with path.open(encoding="utf8", errors="replace") as file:
+        yield from file
+
+
+def import_chat(storage: ChatStorage, chat_id: int, texts: Iterator[str]) -> tuple[int, int]:
+    settings = storage.load_settings(chat_id)
+    lines = []
+    skipped = 0
+    for text in texts:
+        line = clean_sample(text)
+        if line and is_allowed_text(line, settings):
+            lines.append(line)
+        else:
+            skipped += 1
+    if lines:
+        storage.backend.append_samples(chat_id, lines)
+    return len(lines), skipped
+
+
+def prebuild_chat(config: AppConfig, chat_id: int) -> tuple[int, int, float]:
+    started = time.perf_counter()
+    storage = open_storage(config)
+    model = storage.chain(chat_id, storage.load_settings(chat_id).chain_order)
+    asyncio.run(storage.close())
+    return chat_id, model.sample_count, time.perf_counter() - started
+
+
+def prebuild(config: AppConfig, chat_ids: list[int], jobs: int) -> None:
+    if not chat_ids:
+        return
+    with ProcessPoolExecutor(max_workers=max(1, min(jobs, len(chat_ids)))) as pool:
+        futures = [pool.submit(prebuild_chat, config, chat_id) for chat_id in chat_ids]
+        for future in as_completed(futures):
+            chat_id, samples, elapsed = future.result()
+            print(f"{chat_id}: built chain from {samples} samples in {elapsed:.2f}s")
+
+
+def cmd_import(config: AppConfig, args: argparse.Namespace) -> None:
+    storage = open_storage(config)
+    imported: list[int] = []
+    try:
+        for path in args.sources:
+            chat_id, texts = read_source(path, args.format, args.chat_id)
+            started = time.perf_counter()
+            stored, skipped = import_chat(storage, chat_id, texts)
+            elapsed = time.perf_counter() - started
+            print(f"{path}: {stored} samples into chat {chat_id}, {skipped} skipped, {elapsed:.2f}s")
+            imported.append(chat_id)
+    finally:
+        storage.backend.close()
+    if args.prebuild:
+        prebuild(config, sorted(set(imported)), args.jobs)
+
+
+def cmd_export(config: AppConfig, args: argparse.Namespace) -> None:
+    storage = open_storage(config)
+    try:
+        chat_ids = args.chat_id or storage.backend.chat_ids()
+        if args.output_dir is None:
+            if len(chat_ids) != 1:
+                raise SystemExit("--output-dir is required to export more than one chat")
+            for line in storage.iter_samples(chat_ids[0]):
+                sys.stdout.write(line + "\n")
+            return
+
+        args.output_dir.mkdir(parents=True, exist_ok=True)
+        for chat_id in chat_ids:
+            count = 0
+            with (args.output_dir / f"{chat_id}.txt").open("w", encoding="utf8") as file:
+                for line in storage.iter_samples(chat_id):
+                    file.write(line + "\n")
+                    count += 1
+            print(f"{chat_id}: {count} samples", file=sys.stderr)
+    finally:
+        storage.backend.close()
+
+
+def cmd_stats(config: AppConfig, args: argparse.Namespace) -> None:
+    storage = open_storage(config)
+    rows = []
+    try:
+        for chat_id in args.chat_id or storage.backend.chat_ids():
+            snapshot = storage.snapshot_path(chat_id)
+            rows.append(
+                {
+                    "chat_id": chat_id,
+                    "samples": storage.count_samples(chat_id),
+                    "bytes": storage.dialog_size(chat_id),
+                    "snapshot": snapshot is not None and snapshot.exists(),
+                }
+            )
+    finally:
+        storage.backend.close()
+
+    if args.json:
+        print(json.dumps(rows, indent=2))
+        return
+    print(f"{'chat_id':>16} {'samples':>10} {'bytes':>12} snapshot")
+    for row in rows:
+        snapshot = "yes" if row["snapshot"] else "no"
+        print(f"{row['chat_id']:>16} {row['samples']:>10} {row['bytes']:>12} {snapshot}")
+    total_samples = sum(row["samples"] for row in rows)
+    total_bytes = sum(row["bytes"] for row in rows)
+    print(f"{len(rows)} chats, {total_samples} samples, {total_bytes} bytes")
+
+
+def cmd_prebuild(config: AppConfig, args: argparse.Namespace) -> None:
+    chat_ids = args.chat_id
+    if not chat_ids:
+        backend = open_backend(config)
+        chat_ids = backend.chat_ids()
+        backend.close()
+    prebuild(config, chat_ids, args.jobs)
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Offline tools for chat corpora")
+    parser.add_argument("--backend", choices=("files", "sqlite"), help="override STORAGE_BACKEND")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    importer = subparsers.add_parser("import", help="import Telegram exports or text files")
+    importer.add_argument("sources", type=Path, nargs="+")
+    importer.add_argument("--chat-id", type=int, help="target chat (required for text files)")
+    importer.add_argument("--format", choices=("auto", "telegram", "lines"), default="auto")
+    importer.add_argument("--prebuild", action="store_true", help="build chain snapshots")
+    importer.add_argument("--jobs", type=int, default=4, help="processes for --prebuild")
+    importer.set_defaults(handler=cmd_import)
+
+    exporter = subparsers.add_parser("export", help="write samples as plain text")
+    exporter.add_argument("--chat-id", type=int, action="append")
+    exporter.add_argument("--output-dir", type=Path, help="one <chat_id>.txt file per chat")
+    exporter.set_defaults(handler=cmd_export)
+
+    stats = subparsers.add_parser("stats", help="per-chat sample counts and sizes")
+    stats.add_argument("--chat-id", type=int, action="append")
+    stats.add_argument("--json", action="store_true")
+    stats.set_defaults(handler=cmd_stats)
+
+    builder = subparsers.add_parser("prebuild", help="build chain snapshots in parallel")
+    builder.add_argument("--chat-id", type=int, action="append")
+    builder.add_argument("--jobs", type=int, default=4)
+    builder.set_defaults(handler=cmd_prebuild)
+
+    args = parser.parse_args(argv)
+    config = AppConfig.from_env()
+    if args.backend:
+        config = replace(config, storage_backend=args.backend)
+    args.handler(config, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,409 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import itertools
+import json
+import platform
+import random
+import tempfile
+import time
+from collections import Counter
+from contextvars import ContextVar
+from dataclasses import replace
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, AsyncGenerator, Iterator, Optional
+from unittest import mock
+
+from aiogram import Bot, Dispatcher
+from aiogram.client.session.base import BaseSession
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import (
+    AnswerCallbackQuery,
+    EditMessageText,
+    GetChatMember,
+    GetMe,
+    SendMessage,
+    TelegramMethod,
+)
+from aiogram.types import Chat, ChatMemberMember, Message, Update, User
+
+from bench import peak_rss_mb, percentiles, synthetic_corpus
+from bot.app import run_dispatcher
+from bot.backends import open_backend
+from bot.config import AppConfig
+from bot.metrics import AUTO_REPLIES, GENERATE_RESULTS, REPLY_POOL_RESULTS, SEND_RESULTS
+from bot.outbox import Deliver, Produce, SendScheduler
+
+TOKEN = "123456:LOADTEST"
+EPOCH = 1_700_000_000
+SIZES = ("any", "small", "medium", "large")
+
+# seconds since the start of the run, raw Bot API update
+Event = tuple[float, dict[str, Any]]
+
+# the update whose handler, or outbox job, is making the current API call
+_update_id: ContextVar[Optional[int]] = ContextVar("update_id", default=None)
+
+
+class ReplyTracker:
+    def __init__(self) -> None:
+        self.fed = 0
+        self.replies = 0
+        # auto-replies and gen-button results: sends that answer no tracked command
+        self.other_replies = 0
+        self.first_update: Optional[float] = None
+        self.last_reply: Optional[float] = None
+        self.command_latencies: list[float] = []
+        self.callback_latencies: list[float] = []
+        self.errors: Counter[str] = Counter()
+        # update id of each /gen command or gen: button -> when it was fed
+        self._commands: dict[int, float] = {}
+        self._callbacks: dict[int, float] = {}
+
+    def fed_update(self, update: dict[str, Any], now: float) -> None:
+        self.fed += 1
+        if self.first_update is None:
+            self.first_update = now
+        message = update.get("message")
+        if message and message.get("text", "").startswith("/gen"):
+            self._commands[update["update_id"]] = now
+        if "callback_query" in update:
+            self._callbacks[update["update_id"]] = now
+
+    def sent(self, update_id: Optional[int], now: float) -> None:
+        # the first message delivered for a tracked update answers it
+        self.replies += 1
+        self.last_reply = now
+        fed_at = self._commands.pop(update_id, None)
+        if fed_at is not None:
+            self.command_latencies.append(now - fed_at)
+            return
+        fed_at = self._callbacks.pop(update_id, None)
+        if fed_at is not None:
+            self.callback_latencies.append(now - fed_at)
+            return
+        self.other_replies += 1
+
+    def handled(self, task: asyncio.Task) -> None:
+        if not task.cancelled() and task.exception() is not None:
+            self.errors[type(task.exception()).__name__] += 1
+
+    @property
+    def pending(self) -> int:
+        return len(self._commands) + len(self._callbacks)
+
+
+class TrackedScheduler(SendScheduler):
+    # Outbox jobs run on the scheduler's tasks, so each one carries the update
+    # that submitted it into its delivery.
+    def submit(
+        self,
+        chat_id: int,
+        priority: int,
+        produce: Produce,
+        deliver: Deliver,
+    ) -> asyncio.Future:
+        update_id = _update_id.get()
+
+        async def tracked(text: str) -> Any:
+            token = _update_id.set(update_id)
+            try:
+                return await deliver(text)
+            finally:
+                _update_id.reset(token)
+
+        return super().submit(chat_id, priority, produce, tracked)
+
+
+class FakeSession(BaseSession):
+    def __init__(
+        self,
+        tracker: ReplyTracker,
+        latency: float = 0.0,
+        retry_after_rate: float = 0.0,
+        seed: int = 1,
+    ):
+        super().__init__()
+        self.tracker = tracker
+        self.latency = latency
+        self.retry_after_rate = retry_after_rate
+        self.calls: Counter[str] = Counter()
+        self._rng = random.Random(seed)
+        self._message_ids = itertools.count(1_000_000)
+
+    async def close(self) -> None:
+        pass
+
+    async def stream_content(
+        self,
+        url: str,
+        headers: Optional[dict[str, Any]] = None,
+        timeout: int = 30,
+        chunk_size: int = 65536,
+        raise_for_status: bool = True,
+    ) -> AsyncGenerator[bytes, None]:
+        yield b""
+
+    async def make_request(
+        self,
+        bot: Bot,
+        method: TelegramMethod[Any],
+        timeout: Optional[int] = None,
+    ) -> Any:
+        self.calls[type(method).__name__] += 1
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+        if isinstance(method, (SendMessage, EditMessageText)):
+            if self.retry_after_rate and self._rng.random() < self.retry_after_rate:
+                self.calls["RetryAfter"] += 1
+                raise TelegramRetryAfter(method=method, message="Too Many Requests", retry_after=1)
+            self.tracker.sent(_update_id.get(), time.perf_counter())
+            return self._message(bot, int(method.chat_id or 0), method.text)
+        if isinstance(method, AnswerCallbackQuery):
+            return True
+        if isinstance(method, GetChatMember):
+            return ChatMemberMember(user=User(id=method.user_id, is_bot=False, first_name="user"))
+        if isinstance(method, GetMe):
+            return User(id=bot.id, is_bot=True, first_name="witless")
+        return True
+
+    def _message(self, bot: Bot, chat_id: int, text: str) -> Message:
+        return Message(
+            message_id=next(self._message_ids),
+            date=datetime.now(timezone.utc),
+            chat=Chat(id=chat_id, type="supergroup"),
+            from_user=User(id=bot.id, is_bot=True, first_name="witless"),
+            text=text,
+        )
+
+
+def synthetic_stream(
+    chats: int,
+    rate: float,
+    duration: float,
+    seed: int,
+    gen_ratio: float = 0.05,
+    callback_ratio: float = 0.02,
+    skew: float = 1.0,
+    vocab_size: int = 2000,
+) -> Iterator[Event]:
+    rng = random.Random(seed)
+    vocab = [f"w{i}" for i in range(vocab_size)]
+    chat_weights = list(itertools.accumulate(1 / (rank + 1) ** skew for rank in range(chats)))
+    update_ids = itertools.count(1)
+    message_ids = itertools.count(1)
+    at = 0.0
+    while True:
+        at += rng.expovariate(rate)
+        if at >= duration:
+            return
+        index = rng.choices(range(chats), cum_weights=chat_weights)[0]
+        chat = {"id": -1_000_000_000_000 - index, "type": "supergroup"}
+        user = {"id": 1000 + rng.randrange(50), "is_bot": False, "first_name": "user"}
+        update_id = next(update_ids)
+        message = {"message_id": next(message_ids), "date": EPOCH + int(at), "chat": chat, "from": user}
+        roll = rng.random()
+        if roll < callback_ratio:
+            bot_message = {**message, "from": {"id": 123456, "is_bot": True, "first_name": "w"}}
+            query = {
+                "id": str(update_id),
+                "from": user,
+                "chat_instance": str(chat["id"]),
+                "message": bot_message,
+                "data": f"gen:{rng.randrange(len(SIZES))}",
+            }
+            yield at, {"update_id": update_id, "callback_query": query}
+            continue
+        if roll < callback_ratio + gen_ratio:
+            message["text"] = f"/gen {rng.choice(SIZES)}"
+        else:
+            length = min(20, max(1, int(rng.lognormvariate(1.6, 0.7))))
+            message["text"] = " ".join(rng.choices(vocab, k=length))
+        yield at, {"update_id": update_id, "message": message}
+
+
+def read_stream(path: Path, rate: float) -> Iterator[Event]:
+    with path.open(encoding="utf8") as file:
+        for index, line in enumerate(file):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if "update" in record:
+                yield float(record["at"]), record["update"]
+            else:
+                yield index / rate, record
+
+
+def write_stream(path: Path, events: list[Event]) -> None:
+    with path.open("w", encoding="utf8") as file:
+        for at, update in events:
+            file.write(json.dumps({"at": round(at, 6), "update": update}, ensure_ascii=False))
+            file.write("\n")
+
+
+def seed_corpus(config: AppConfig, events: list[Event], lines: int, seed: int) -> None:
+    if lines <= 0:
+        return
+    chat_ids = set()
+    for _, update in events:
+        event = update.get("message") or update.get("callback_query", {}).get("message")
+        if event:
+            chat_ids.add(event["chat"]["id"])
+    corpus = synthetic_corpus(lines, seed)
+    backend = open_backend(config)
+    try:
+        for chat_id in sorted(chat_ids):
+            backend.append_samples(chat_id, corpus)
+    finally:
+        backend.close()
+
+
+async def replay(
+    dispatcher: Dispatcher,
+    bot: Bot,
+    events: list[Event],
+    tracker: ReplyTracker,
+    speed: float,
+    drain_timeout: float,
+) -> float:
+    loop = asyncio.get_running_loop()
+    tasks: set[asyncio.Task] = set()
+    started = loop.time()
+    for at, raw in events:
+        delay = started + at / speed - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        update = Update.model_validate(raw, context={"bot": bot})
+        tracker.fed_update(raw, time.perf_counter())
+        # the handler task copies the context, and with it the update id
+        token = _update_id.set(raw["update_id"])
+        task = asyncio.create_task(dispatcher.feed_update(bot, update))
+        _update_id.reset(token)
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+        task.add_done_callback(tracker.handled)
+    if tasks:
+        await asyncio.gather(*tasks, return_exceptions=True)
+    fed_elapsed = loop.time() - started
+
+    deadline = loop.time() + drain_timeout
+    while tracker.pending and loop.time() < deadline:
+        await asyncio.sleep(0.05)
+    return fed_elapsed
+
+
+def run(args: argparse.Namespace) -> dict[str, Any]:
+    if args.replay:
+        events = list(read_stream(args.replay, args.rate))
+    else:
+        events = list(
+            synthetic_stream(
+                args.chats,
+                args.rate,
+                args.duration,
+                args.seed,
+                gen_ratio=args.gen_ratio,
+                callback_ratio=args.callback_ratio,
+                skew=args.skew,
+            )
+        )
+    if args.record:
+        write_stream(args.record, events)
+
+    random.seed(args.seed)
+    tracker = ReplyTracker()
+    session = FakeSession(tracker, args.api_latency, args.retry_after_rate, args.seed)
+    result: dict[str, Any] = {}
+
+    async def intake(dispatcher: Dispatcher, bot: Bot, config: AppConfig) -> None:
+        cpu_started = time.process_time()
+        fed_elapsed = await replay(dispatcher, bot, events, tracker, args.speed, args.drain)
+        result["fed_seconds"] = fed_elapsed
+        result["cpu_seconds"] = time.process_time() - cpu_started
+
+    with tempfile.TemporaryDirectory() as tmp:
+        config = replace(
+            AppConfig.from_env(),
+            token=TOKEN,
+            dialogs_dir=Path(tmp) / "dialogs",
+            settings_dir=Path(tmp) / "settings",
+            sqlite_path=Path(tmp) / "witless.sqlite3",
+            snapshot_dir=Path(tmp) / "models",
+            run_mode="polling",
+            workers=1,
+            metrics_port=0,
+            metrics_log_interval=0.0,
+        )
+        if args.backend:
+            config = replace(config, storage_backend=args.backend)
+        seed_corpus(config, events, args.seed_lines, args.seed)
+        with mock.patch("bot.app.SendScheduler", TrackedScheduler):
+            asyncio.run(run_dispatcher(config, intake, session))
+
+    elapsed = result["fed_seconds"]
+    span = (tracker.last_reply or 0) - (tracker.first_update or 0)
+    return {
+        "updates": tracker.fed,
+        "updates_per_sec": tracker.fed / elapsed if elapsed else 0.0,
+        "replies": tracker.replies,
+        "replies_per_sec": tracker.replies / span if span > 0 else 0.0,
+        "command_replies": len(tracker.command_latencies),
+        "auto_replies": sum(value for _, value in AUTO_REPLIES.samples()),
+        "other_replies": tracker.other_replies,
+        "unanswered": tracker.pending,
+        "errors": dict(tracker.errors),
+        "command_latency": percentiles(tracker.command_latencies)
+        if tracker.command_latencies
+        else {},
+        "callback_latency": percentiles(tracker.callback_latencies)
+        if tracker.callback_latencies
+        else {},
+        "api_calls": dict(session.calls),
+        "send": dict(SEND_RESULTS.samples()),
+        "generate": dict(GENERATE_RESULTS.samples()),
+        "reply_pool": dict(REPLY_POOL_RESULTS.samples()),
+        "cpu_seconds": result["cpu_seconds"],
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Replay updates against a fake Bot API")
+    parser.add_argument("--replay", type=Path, help="JSONL of recorded or raw updates")
+    parser.add_argument("--record", type=Path, help="write the update stream as JSONL")
+    parser.add_argument("--chats", type=int, default=100)
+    parser.add_argument("--rate", type=float, default=200.0, help="updates per second")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds of traffic")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay time multiplier")
+    parser.add_argument("--gen-ratio", type=float, default=0.05, help="share of /gen commands")
+    parser.add_argument("--callback-ratio", type=float, default=0.02, help="share of gen: buttons")
+    parser.add_argument("--skew", type=float, default=1.0, help="Zipf exponent of chat traffic")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--seed-lines", type=int, default=1000, help="samples preloaded per chat")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="fake Bot API delay")
+    parser.add_argument("--retry-after-rate", type=float, default=0.0, help="share of 429s")
+    parser.add_argument("--drain", type=float, default=30.0, help="seconds to wait for replies")
+    parser.add_argument("--backend", choices=("files", "sqlite"), help="override STORAGE_BACKEND")
+    parser.add_argument("--output", type=Path, help="write results as JSON")
+    args = parser.parse_args(argv)
+
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": {key: str(value) for key, value in vars(args).items()},
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        },
+        "results": run(args),
+    }
+    payload = json.dumps(report, indent=2)
+    if args.output:
+        args.output.write_text(payload, encoding="utf8")
+    else:
+        print(payload)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+import asyncio
+import json
+
+from aiogram.types import Update
+
+from bot.sharding import HashRing, ShardForwarder, update_chat_id, update_payload
+
+USER = {"id": 42, "is_bot": False, "first_name": "Ann"}
+
+INLINE_CALLBACK = {
+    "update_id": 1,
+    "callback_query": {
+        "id": "7",
+        "from": USER,
+        "chat_instance": "ci",
+        "inline_message_id": "im-1",
+        "data": "gen:2",
+    },
+}
+
+INLINE_QUERY = {
+    "update_id": 2,
+    "inline_query": {"id": "9", "from": USER, "query": "hi", "offset": ""},
+}
+
+MESSAGE = {
+    "update_id": 3,
+    "message": {
+        "message_id": 5,
+        "date": 1_700_000_000,
+        "chat": {"id": -100123, "type": "supergroup", "title": "t"},
+        "from": USER,
+        "text": "hello",
+    },
+}
+
+
+class _Writer:
+    def __init__(self):
+        self.lines = []
+
+    def write(self, data: bytes) -> None:
+        self.lines.append(data)
+
+    async def drain(self) -> None:
+        pass
+
+
+def _forward(raw: dict, writers: list[_Writer]) -> None:
+    forwarder = ShardForwarder(writers)
+    update = Update.model_validate(raw)
+    asyncio.run(forwarder(lambda *_: None, update, {}))
+
+
+def test_payload_uses_bot_api_field_names():
+    for raw, chat_id in ((INLINE_CALLBACK, 42), (INLINE_QUERY, 42), (MESSAGE, -100123)):
+        payload = update_payload(Update.model_validate(raw))
+        assert update_chat_id(payload) == chat_id
+
+
+def test_forwarded_updates_round_trip():
+    for raw in (INLINE_CALLBACK, INLINE_QUERY, MESSAGE):
+        writers = [_Writer(), _Writer(), _Writer()]
+        _forward(raw, writers)
+
+        node = HashRing(len(writers)).node_for(update_chat_id(raw))
+        assert [len(writer.lines) for writer in writers].count(1) == 1
+        assert len(writers[node].lines) == 1
+        forwarded = Update.model_validate(json.loads(writers[node].lines[0]))
+        assert forwarded == Update.model_validate(raw)